@@ -0,0 +1,80 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import get_async_db
+from app.schemas.game import BaseInfo, QueryReq, MessageResponse
+from app.services.migrator import migrator
+from app.services import async_game_service
+from app.utils.validator import is_valid_game_name
+
+# Same routes and responses as endpoints.router, served on the async engine (settings.DB_ASYNC)
+router = APIRouter()
+
+@router.post("/createNewGame", response_model=MessageResponse)
+async def create_new_game(game: BaseInfo, db: AsyncSession = Depends(get_async_db)):
+    if not is_valid_game_name(game.game_name):
+         raise HTTPException(status_code=400, detail="游戏名必须是字母数字或下划线且以字母开头")
+    try:
+        await async_game_service.create_table(db, game.game_name)
+        return {"message": "create new game table success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/insert", response_model=MessageResponse)
+async def insert_game(game: BaseInfo, db: AsyncSession = Depends(get_async_db)):
+    if not is_valid_game_name(game.game_name):
+         raise HTTPException(status_code=400, detail="游戏名必须是字母数字或下划线且以字母开头")
+    try:
+        await async_game_service.insert_game(db, game)
+        return {"message": "insert success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/insertBatch", response_model=MessageResponse)
+async def insert_batch(games: List[BaseInfo], db: AsyncSession = Depends(get_async_db)):
+    # Rows may span games; all of them are written in one transaction
+    try:
+        await async_game_service.insert_batch(db, games)
+        return {"message": "insert success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/update", response_model=MessageResponse)
+async def update_game(game: BaseInfo, db: AsyncSession = Depends(get_async_db)):
+    if not is_valid_game_name(game.game_name):
+         raise HTTPException(status_code=400, detail="游戏名必须是字母数字或下划线且以字母开头")
+    try:
+        await async_game_service.update_game(db, game)
+        return {"message": "update success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/query", response_model=MessageResponse)
+async def query_game(query: QueryReq, db: AsyncSession = Depends(get_async_db)):
+    if not is_valid_game_name(query.game_name):
+         raise HTTPException(status_code=400, detail="游戏名必须是字母数字或下划线且以字母开头")
+    if query.online_duration == 0:
+        raise HTTPException(status_code=400, detail="在线时长不能为0")
+    try:
+        result = await async_game_service.query_game(db, query)
+        return {"message": "query success", "data": result}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/clearTalkChannel", response_model=MessageResponse)
+async def clear_talk_channel(query: QueryReq, db: AsyncSession = Depends(get_async_db)):
+    if not is_valid_game_name(query.game_name):
+         raise HTTPException(status_code=400, detail="游戏名必须是字母数字或下划线且以字母开头")
+    try:
+        if query.talk_channel is None:
+             raise HTTPException(status_code=400, detail="talk_channel is required")
+
+        await async_game_service.clear_talk_time(db, query.game_name, query.talk_channel)
+        return {"message": "clear talk time channel success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/migrationStatus")
+async def migration_status():
+    # Per game table: state, duplicate rows removed and the last error
+    return {"message": "migration status", "data": migrator.stats()}
@@ -1,7 +1,12 @@
+import asyncio
+from typing import List
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.core.database import get_db
 from app.schemas.game import BaseInfo, QueryReq, MessageResponse
+from app.services.migrator import migrator
 from app.services import game_service
 from app.utils.validator import is_valid_game_name
 
@@ -18,11 +23,27 @@ def create_new_game(game: BaseInfo, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/insert", response_model=MessageResponse)
-def insert_game(game: BaseInfo, db: Session = Depends(get_db)):
+async def insert_game(game: BaseInfo, db: Session = Depends(get_db)):
     if not is_valid_game_name(game.game_name):
          raise HTTPException(status_code=400, detail="游戏名必须是字母数字或下划线且以字母开头")
     try:
-        game_service.insert_game(db, game)
+        # With the insert buffer the commit ack is awaited here rather than in
+        # game_service.insert_game, so it does not hold a threadpool thread for a flush interval
+        future = game_service.submit_buffered(game)
+        if future is not None:
+            if settings.INSERT_ACK == "commit":
+                await asyncio.wrap_future(future)
+        else:
+            await run_in_threadpool(game_service.insert_game, db, game)
+        return {"message": "insert success"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/insertBatch", response_model=MessageResponse)
+def insert_batch(games: List[BaseInfo], db: Session = Depends(get_db)):
+    # Rows may span games; all of them are written in one transaction
+    try:
+        game_service.insert_batch(db, games)
         return {"message": "insert success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -62,3 +83,8 @@ def clear_talk_channel(query: QueryReq, db: Session = Depends(get_db)):
         return {"message": "clear talk time channel success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/migrationStatus")
+def migration_status():
+    # Per game table: state, duplicate rows removed and the last error
+    return {"message": "migration status", "data": migrator.stats()}
@@ -1,5 +1,6 @@
 import os
 import sys
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 def get_env_path():
@@ -28,6 +29,28 @@ class Settings(BaseSettings):
     
     HTTP_PORT: int = 9091
 
+    # Serve the API with async endpoints on an aiomysql engine instead of the
+    # sync PyMySQL one (requires aiomysql)
+    DB_ASYNC: bool = False
+
+    # Group commit for /insert: rows are coalesced per table and account and
+    # written every INSERT_FLUSH_MS or once a table holds INSERT_FLUSH_ROWS
+    # accounts. INSERT_ACK="commit" answers after the write committed,
+    # "enqueue" answers at once (rows still buffered are lost on a crash);
+    # any other value is rejected at startup.
+    INSERT_BUFFER: bool = False
+    INSERT_FLUSH_MS: int = 50
+    INSERT_FLUSH_ROWS: int = 500
+    INSERT_ACK: Literal["commit", "enqueue"] = "commit"
+
+    # Background migration of existing game tables at startup: removes
+    # duplicate accounts (keeping the latest heartbeat), adds uk_account and
+    # the query indexes online. See app/services/migrator.py.
+    SCHEMA_MIGRATION: bool = True
+    MIGRATE_CHUNK_SIZE: int = 1000
+    MIGRATE_LOCK_WAIT_TIMEOUT: int = 5
+    MIGRATE_RETRIES: int = 3
+
     class Config:
         env_file = get_env_path()
         env_file_encoding = 'utf-8'
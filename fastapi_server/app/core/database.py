@@ -4,14 +4,16 @@ from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
 SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{settings.MYSQL_USER}:{settings.MYSQL_PASSWORD}@{settings.MYSQL_HOST}:{settings.MYSQL_PORT}/{settings.MYSQL_DB}?charset={settings.MYSQL_CHARSET}"
+ASYNC_DATABASE_URL = f"mysql+aiomysql://{settings.MYSQL_USER}:{settings.MYSQL_PASSWORD}@{settings.MYSQL_HOST}:{settings.MYSQL_PORT}/{settings.MYSQL_DB}?charset={settings.MYSQL_CHARSET}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
+POOL_OPTIONS = dict(
     pool_pre_ping=True,
     pool_size=20,          # Increase pool size (default is 5)
     max_overflow=40,       # Increase overflow (default is 10)
     pool_recycle=3600,     # Recycle connections every hour
 )
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -22,3 +24,18 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Async engine (settings.DB_ASYNC); only created when enabled, so aiomysql is
+# not needed for the default sync setup
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_OPTIONS)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
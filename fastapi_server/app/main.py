@@ -2,9 +2,11 @@ import uvicorn
 from fastapi import FastAPI
 from sqlalchemy import text, create_engine
 from contextlib import asynccontextmanager
-from app.api import endpoints
+from app.api import endpoints, async_endpoints
 from app.core.config import settings
-from app.core.database import engine
+from app.core.database import engine, async_engine
+from app.services.game_service import insert_buffer
+from app.services.migrator import migrator
 import sys
 
 @asynccontextmanager
@@ -35,25 +37,43 @@ async def lifespan(app: FastAPI):
     # Startup: 2. Check connection to the specific database
     print("正在尝试连接数据库... (Connecting to Database...)")
     try:
-        with engine.connect() as connection:
-            connection.execute(text("SELECT 1"))
+        if async_engine is not None:
+            async with async_engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+        else:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
         print("✅  数据库连接成功! (Database Connection Successful)")
         print(f"    Host: {settings.MYSQL_HOST}")
         print(f"    Port: {settings.MYSQL_PORT}")
         print(f"    DB:   {settings.MYSQL_DB}")
+        print(f"    Mode: {'async (aiomysql)' if async_engine is not None else 'sync (pymysql)'}")
     except Exception as e:
         print("❌  数据库连接失败! (Database Connection Failed)")
         print(f"    Error: {e}")
         print("    请检查 .env 文件配置是否正确，及 MySQL 服务是否启动")
+    if settings.SCHEMA_MIGRATION:
+        # Runs in the background; progress is printed and served at /migrationStatus
+        migrator.start()
+        print("    Schema migration started in the background")
+    if settings.INSERT_BUFFER:
+        insert_buffer.start()
+        print(f"    Insert buffer: every {settings.INSERT_FLUSH_MS} ms or {settings.INSERT_FLUSH_ROWS} rows, ack on {settings.INSERT_ACK}")
     print("="*40 + "\n")
     
     yield
     
     print("Server shutting down...")
+    insert_buffer.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 app = FastAPI(title="FSJS SQL Server", lifespan=lifespan)
 
-app.include_router(endpoints.router)
+if settings.DB_ASYNC:
+    app.include_router(async_endpoints.router)
+else:
+    app.include_router(endpoints.router)
 
 if __name__ == "__main__":
     # When running as a frozen app (exe), reload must be False
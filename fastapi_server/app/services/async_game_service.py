@@ -0,0 +1,151 @@
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from app.schemas.game import BaseInfo, QueryReq
+from app.utils.validator import is_valid_game_name
+from app.core.config import settings
+from app.services import game_service
+from app.services.game_service import (
+    DEFAULT_MAX_ALLOWED_PACKET,
+    MAX_ALLOWED_PACKET_SQL,
+    ACCOUNT_INDEXES_SQL,
+    batch_chunks,
+    build_query,
+    cached_upsert_mode,
+    claim_update_sql,
+    clear_talk_sql,
+    create_table_sql,
+    group_batch,
+    insert_missing_sql,
+    record_account_indexes,
+    submit_buffered,
+    get_talk_channel_field,
+    is_skip_locked_unsupported,
+    to_base_info,
+    update_params,
+    update_sql,
+    upsert_batch_params,
+    upsert_batch_sql,
+    upsert_params,
+    upsert_sql,
+)
+from datetime import datetime
+
+# Async counterparts of game_service (settings.DB_ASYNC), running the same SQL
+# on an AsyncSession so a request waiting on MySQL does not hold a threadpool thread.
+
+async def create_table(db: AsyncSession, game_name: str):
+    if not is_valid_game_name(game_name):
+        raise ValueError("Invalid game name")
+
+    await db.execute(text(create_table_sql(game_name)))
+    await db.commit()
+
+async def insert_game(db: AsyncSession, game: BaseInfo):
+    if not is_valid_game_name(game.game_name):
+        raise ValueError("Invalid game name")
+
+    future = submit_buffered(game)
+    if future is not None:
+        if settings.INSERT_ACK == "commit":
+            await asyncio.wrap_future(future)
+        return
+
+    now = datetime.now()
+    try:
+        if await can_upsert(db, game.game_name):
+            await db.execute(text(upsert_sql(game.game_name)), upsert_params(game, now))
+        else:
+            await upsert_without_unique_key(db, game.game_name, upsert_params(game, now))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise e
+
+async def can_upsert(db: AsyncSession, game_name: str) -> bool:
+    upsert = cached_upsert_mode(game_name)
+    if upsert is None:
+        rows = await db.execute(text(ACCOUNT_INDEXES_SQL), {"table_name": game_name})
+        upsert = record_account_indexes(game_name, {row[0] for row in rows})
+    return upsert
+
+async def upsert_without_unique_key(db: AsyncSession, game_name: str, params: dict):
+    if (await db.execute(text(update_sql(game_name)), params)).rowcount == 0:
+        await db.execute(text(insert_missing_sql(game_name)), params)
+
+async def write_rows(db: AsyncSession, game_name: str, rows: list, now: datetime):
+    if await can_upsert(db, game_name):
+        for chunk in batch_chunks(rows, await get_max_allowed_packet(db)):
+            await db.execute(text(upsert_batch_sql(game_name, len(chunk))), upsert_batch_params(game_name, chunk, now))
+    else:
+        for game in rows:
+            await upsert_without_unique_key(db, game_name, upsert_params(game, now))
+
+async def get_max_allowed_packet(db: AsyncSession) -> int:
+    if game_service._max_allowed_packet is None:
+        try:
+            game_service._max_allowed_packet = int((await db.execute(text(MAX_ALLOWED_PACKET_SQL))).scalar())
+        except Exception:
+            return DEFAULT_MAX_ALLOWED_PACKET
+    return game_service._max_allowed_packet
+
+async def insert_batch(db: AsyncSession, games: list) -> int:
+    groups = group_batch(games)
+    if not groups:
+        return 0
+
+    now = datetime.now()
+    written = 0
+    try:
+        for game_name, rows in groups.items():
+            await write_rows(db, game_name, rows, now)
+            written += len(rows)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise e
+    return written
+
+async def update_game(db: AsyncSession, game: BaseInfo):
+    if not is_valid_game_name(game.game_name):
+        raise ValueError("Invalid game name")
+
+    now = datetime.now()
+    await db.execute(text(update_sql(game.game_name)), update_params(game, now))
+    await db.commit()
+
+async def clear_talk_time(db: AsyncSession, game_name: str, talk_channel: int):
+    if not is_valid_game_name(game_name):
+        raise ValueError("Invalid game name")
+
+    field = get_talk_channel_field(talk_channel)
+    if not field:
+        return
+
+    await db.execute(text(clear_talk_sql(game_name, field)))
+    await db.commit()
+
+async def query_game(db: AsyncSession, query: QueryReq):
+    if not is_valid_game_name(query.game_name):
+        raise ValueError("Invalid game name")
+
+    now = datetime.now()
+    select_sql, params, talk_channel_field = build_query(query, now)
+
+    # Same locking as game_service.query_game: SKIP LOCKED, or plain FOR UPDATE on older MySQL
+    try:
+        result = (await db.execute(text(select_sql + " FOR UPDATE SKIP LOCKED"), params)).fetchall()
+    except Exception as e:
+        if is_skip_locked_unsupported(e):
+            print("Warning: SKIP LOCKED not supported, falling back to FOR UPDATE")
+            result = (await db.execute(text(select_sql + " FOR UPDATE"), params)).fetchall()
+        else:
+            raise e
+
+    if result and talk_channel_field:
+        ids = [row.id for row in result]
+        if ids:
+            await db.execute(text(claim_update_sql(query.game_name, talk_channel_field, ids)), {"now": now})
+            await db.commit()
+
+    return [to_base_info(row) for row in result]
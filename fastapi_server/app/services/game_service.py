@@ -2,8 +2,12 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.schemas.game import BaseInfo, Account, QueryReq
 from app.utils.validator import is_valid_game_name
-from datetime import datetime
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.services.insert_buffer import InsertBuffer
+from datetime import datetime, timedelta
 import threading
+import time
 from collections import defaultdict
 
 # Removed LockManager class and lock usage for better concurrency
@@ -16,12 +20,8 @@ def get_talk_channel_field(talk_channel: int) -> str:
         return f"last_talk_time{talk_channel}"
     raise ValueError(f"喊话通道{talk_channel}暂无")
 
-def create_table(db: Session, game_name: str):
-    if not is_valid_game_name(game_name):
-        raise ValueError("Invalid game name")
-    
-    # Use database DDL execution directly
-    create_table_sql = f"""
+def create_table_sql(game_name: str) -> str:
+    return f"""
     CREATE TABLE IF NOT EXISTS `{game_name}` (
         id INT PRIMARY KEY AUTO_INCREMENT,
         created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,  
@@ -37,30 +37,57 @@ def create_table(db: Session, game_name: str):
         last_talk_time4 DATETIME DEFAULT '2000-01-01 00:00:00',                               
         last_talk_time5 DATETIME DEFAULT '2000-01-01 00:00:00',                                
         last_talk_time6 DATETIME DEFAULT '2000-01-01 00:00:00',
-        UNIQUE KEY `uk_account` (`account`)
+        UNIQUE KEY `uk_account` (`account`),
+        {index_definitions()}
     );
     """
+
+# Secondary indexes for the query_game predicates (online_time / last_talk_timeN
+# cutoffs, optionally with the zones); name -> columns
+TABLE_INDEXES = {
+    "idx_online_time": "`online_time`",
+    "idx_zone_online": "`b_zone`, `s_zone`, `online_time`",
+    **{f"idx_talk_time{n}": f"`last_talk_time{n}`" for n in range(1, 7)},
+}
+
+INDEX_NAMES_SQL = """
+SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name
+"""
+
+def index_definitions() -> str:
+    return ",\n        ".join(f"KEY `{name}` ({columns})" for name, columns in TABLE_INDEXES.items())
+
+def add_indexes_sql(game_name: str, existing: set):
+    """ALTER TABLE adding the TABLE_INDEXES the table lacks, or None if it has them all."""
+    missing = [name for name in TABLE_INDEXES if name not in existing]
+    if not missing:
+        return None
+    adds = ", ".join(f"ADD INDEX `{name}` ({TABLE_INDEXES[name]})" for name in missing)
+    # In-place build: the table stays readable and writable meanwhile
+    return f"ALTER TABLE `{game_name}` {adds}, ALGORITHM=INPLACE, LOCK=NONE"
+
+def create_table(db: Session, game_name: str):
+    if not is_valid_game_name(game_name):
+        raise ValueError("Invalid game name")
+    
+    # Use database DDL execution directly
     # Note: Added UNIQUE KEY on account to support efficient UPSERT
     # If the table already exists without this key, ON DUPLICATE KEY UPDATE might behave differently (row locking vs table locking)
     # But for safety, we assume 'account' should be unique per game table.
     
-    db.execute(text(create_table_sql))
-    # We should add the index if it doesn't exist, but 'CREATE TABLE IF NOT EXISTS' won't modify existing tables.
-    # For now, we rely on the logic that we want high concurrency.
+    db.execute(text(create_table_sql(game_name)))
+    # 'CREATE TABLE IF NOT EXISTS' won't modify existing tables. Their uk_account and
+    # TABLE_INDEXES are added by the background migrator (app/services/migrator.py),
+    # never here: an ALTER on a busy table would hold this request and queue traffic behind it.
     db.commit()
 
-def insert_game(db: Session, game: BaseInfo):
-    if not is_valid_game_name(game.game_name):
-        raise ValueError("Invalid game name")
-    
-    now = datetime.now()
-    
+def upsert_sql(game_name: str) -> str:
     # Use INSERT ... ON DUPLICATE KEY UPDATE for atomic UPSERT
     # This avoids the need for application-level locking (check-then-insert)
     # And lets the database handle row-level locking.
-    
-    upsert_sql = f"""
-    INSERT INTO `{game.game_name}` (game_name, account, b_zone, s_zone, rating, online_time, created_at)
+    return f"""
+    INSERT INTO `{game_name}` (game_name, account, b_zone, s_zone, rating, online_time, created_at)
     VALUES (:game_name, :account, :b_zone, :s_zone, :rating, :online_time, :created_at)
     ON DUPLICATE KEY UPDATE
         b_zone = VALUES(b_zone),
@@ -68,6 +95,98 @@ def insert_game(db: Session, game: BaseInfo):
         rating = VALUES(rating),
         online_time = VALUES(online_time)
     """
+
+def upsert_params(game: BaseInfo, now: datetime) -> dict:
+    return {
+        "game_name": game.game_name,
+        "account": game.account,
+        "b_zone": game.b_zone,
+        "s_zone": game.s_zone,
+        "rating": game.rating,
+        "online_time": now,
+        "created_at": now
+    }
+
+# Tables created by the old Go server have no uk_account until the schema
+# migrator adds it, so ON DUPLICATE KEY UPDATE inserts a duplicate row on every
+# heartbeat. Once the migrator has put DEDUPE_INDEX on such a table (its first
+# step, before removing duplicates), writes go through upsert_without_unique_key
+# so no new duplicates appear behind it. Tables with neither index keep the plain
+# upsert: without an index on account the UPDATE would lock every row it scans.
+DEDUPE_INDEX = "idx_account_dedupe"
+ACCOUNT_INDEXES_SQL = f"""
+SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND INDEX_NAME IN ('uk_account', '{DEDUPE_INDEX}')
+"""
+# Tables without uk_account are looked up again after this many seconds; the
+# migrator waits as long after adding DEDUPE_INDEX before it deduplicates
+UNIQUE_KEY_RECHECK = 10.0
+_unique_tables = set()
+_pending_tables: dict = {}
+_unique_lock = threading.Lock()
+
+def cached_upsert_mode(game_name: str):
+    """Whether writes may use ON DUPLICATE KEY UPDATE: True/False, or None if not known."""
+    if game_name in _unique_tables:
+        return True
+    checked = _pending_tables.get(game_name)
+    if checked is not None and time.monotonic() - checked[0] < UNIQUE_KEY_RECHECK:
+        return checked[1]
+    return None
+
+def record_account_indexes(game_name: str, indexes: set) -> bool:
+    """Cache the table's account indexes; returns whether writes may use ON DUPLICATE KEY UPDATE."""
+    with _unique_lock:
+        if "uk_account" in indexes:
+            _unique_tables.add(game_name)
+            _pending_tables.pop(game_name, None)
+            return True
+        upsert = DEDUPE_INDEX not in indexes
+        _pending_tables[game_name] = (time.monotonic(), upsert)
+        return upsert
+
+def can_upsert(db: Session, game_name: str) -> bool:
+    upsert = cached_upsert_mode(game_name)
+    if upsert is None:
+        indexes = {row[0] for row in db.execute(text(ACCOUNT_INDEXES_SQL), {"table_name": game_name})}
+        upsert = record_account_indexes(game_name, indexes)
+    return upsert
+
+def insert_missing_sql(game_name: str) -> str:
+    # Single statement: the NOT EXISTS read locks the account's range in DEDUPE_INDEX,
+    # so two heartbeats of a new account cannot both insert it
+    return f"""
+    INSERT INTO `{game_name}` (game_name, account, b_zone, s_zone, rating, online_time, created_at)
+    SELECT :game_name, :account, :b_zone, :s_zone, :rating, :online_time, :created_at FROM DUAL
+    WHERE NOT EXISTS (SELECT 1 FROM `{game_name}` WHERE account = :account)
+    """
+
+def upsert_without_unique_key(db: Session, game_name: str, params: dict):
+    """UPDATE the account's rows, INSERT only if there were none (params as from upsert_params)."""
+    if db.execute(text(update_sql(game_name)), params).rowcount == 0:
+        db.execute(text(insert_missing_sql(game_name)), params)
+
+def write_rows(db: Session, game_name: str, rows: list, now: datetime):
+    """Upsert one table's rows in the current transaction: multi-row statements unless the table is being deduplicated."""
+    if can_upsert(db, game_name):
+        for chunk in batch_chunks(rows, get_max_allowed_packet(db)):
+            db.execute(text(upsert_batch_sql(game_name, len(chunk))), upsert_batch_params(game_name, chunk, now))
+    else:
+        for game in rows:
+            upsert_without_unique_key(db, game_name, upsert_params(game, now))
+
+def insert_game(db: Session, game: BaseInfo):
+    if not is_valid_game_name(game.game_name):
+        raise ValueError("Invalid game name")
+    
+    future = submit_buffered(game)
+    if future is not None:
+        if settings.INSERT_ACK == "commit":
+            # Blocks the calling thread until the flush; the /insert endpoint awaits the future instead
+            future.result()
+        return
+
+    now = datetime.now()
     
     # Note: This relies on `account` having a UNIQUE index. 
     # If the table was created by the old Go code or previous version without Unique Key, 
@@ -80,15 +199,10 @@ def insert_game(db: Session, game: BaseInfo):
     # Best approach for "Performance": Assume/Enforce Unique Key.
     
     try:
-        db.execute(text(upsert_sql), {
-            "game_name": game.game_name,
-            "account": game.account,
-            "b_zone": game.b_zone,
-            "s_zone": game.s_zone,
-            "rating": game.rating,
-            "online_time": now,
-            "created_at": now
-        })
+        if can_upsert(db, game.game_name):
+            db.execute(text(upsert_sql(game.game_name)), upsert_params(game, now))
+        else:
+            upsert_without_unique_key(db, game.game_name, upsert_params(game, now))
         db.commit()
     except Exception as e:
         db.rollback()
@@ -96,25 +210,155 @@ def insert_game(db: Session, game: BaseInfo):
         # But for now, just re-raise
         raise e
 
-def update_game(db: Session, game: BaseInfo):
-    if not is_valid_game_name(game.game_name):
-        raise ValueError("Invalid game name")
-    
+# Multi-row upserts for /insertBatch. Each statement stays well below
+# max_allowed_packet: ROW_OVERHEAD bytes per row plus its string values,
+# counted as utf8mb4 bytes and ESCAPE_FACTOR times over since the driver
+# escapes them into the SQL text.
+BATCH_MAX_ROWS = 1000
+ROW_OVERHEAD = 64
+ESCAPE_FACTOR = 2
+PACKET_FRACTION = 0.5
+DEFAULT_MAX_ALLOWED_PACKET = 4 * 1024 * 1024
+MAX_ALLOWED_PACKET_SQL = "SELECT @@max_allowed_packet"
+
+def group_batch(games: list) -> dict:
+    """Rows per game table, in request order, with only the last row kept per account."""
+    groups = defaultdict(dict)
+    for game in games:
+        if not is_valid_game_name(game.game_name):
+            raise ValueError(f"Invalid game name: {game.game_name}")
+        rows = groups[game.game_name]
+        # Rows without an account never conflict on uk_account, so each is kept
+        key = game.account if game.account is not None else len(rows)
+        rows.pop(key, None)
+        rows[key] = game
+    return {game_name: list(rows.values()) for game_name, rows in groups.items()}
+
+def batch_chunks(rows: list, max_allowed_packet: int):
+    """Split rows into chunks that fit in one statement."""
+    budget = int(max_allowed_packet * PACKET_FRACTION)
+    chunk = []
+    size = 0
+    for game in rows:
+        row_size = ROW_OVERHEAD + ESCAPE_FACTOR * sum(
+            len(str(v).encode("utf-8")) for v in (game.account, game.b_zone, game.s_zone) if v
+        )
+        if chunk and (len(chunk) >= BATCH_MAX_ROWS or size + row_size > budget):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(game)
+        size += row_size
+    if chunk:
+        yield chunk
+
+def upsert_batch_sql(game_name: str, count: int) -> str:
+    values = ", ".join(
+        f"(:game_name, :account_{i}, :b_zone_{i}, :s_zone_{i}, :rating_{i}, :now, :now)" for i in range(count)
+    )
+    return f"""
+    INSERT INTO `{game_name}` (game_name, account, b_zone, s_zone, rating, online_time, created_at)
+    VALUES {values}
+    ON DUPLICATE KEY UPDATE
+        b_zone = VALUES(b_zone),
+        s_zone = VALUES(s_zone),
+        rating = VALUES(rating),
+        online_time = VALUES(online_time)
+    """
+
+def upsert_batch_params(game_name: str, chunk: list, now: datetime) -> dict:
+    params = {"game_name": game_name, "now": now}
+    for i, game in enumerate(chunk):
+        params[f"account_{i}"] = game.account
+        params[f"b_zone_{i}"] = game.b_zone
+        params[f"s_zone_{i}"] = game.s_zone
+        params[f"rating_{i}"] = game.rating
+    return params
+
+_max_allowed_packet = None
+
+def get_max_allowed_packet(db: Session) -> int:
+    global _max_allowed_packet
+    if _max_allowed_packet is None:
+        try:
+            _max_allowed_packet = int(db.execute(text(MAX_ALLOWED_PACKET_SQL)).scalar())
+        except Exception:
+            # Not cached, so the real value is read once the server answers
+            return DEFAULT_MAX_ALLOWED_PACKET
+    return _max_allowed_packet
+
+def insert_batch(db: Session, games: list) -> int:
+    """Upsert many rows in one transaction: one multi-row statement per game table and chunk.
+
+    Returns the number of rows written after per-account de-duplication.
+    """
+    groups = group_batch(games)
+    if not groups:
+        return 0
+
     now = datetime.now()
-    update_sql = f"""
-    UPDATE `{game.game_name}` 
+    written = 0
+    try:
+        for game_name, rows in groups.items():
+            write_rows(db, game_name, rows, now)
+            written += len(rows)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    return written
+
+def write_buffered(game_name: str, rows: list):
+    """InsertBuffer flush: the table's coalesced rows in one transaction on a session of its own."""
+    db = SessionLocal()
+    try:
+        write_rows(db, game_name, rows, datetime.now())
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+insert_buffer = InsertBuffer(write_buffered, settings.INSERT_FLUSH_MS, settings.INSERT_FLUSH_ROWS)
+
+def submit_buffered(game: BaseInfo):
+    """Queue the row in insert_buffer if it is running; None means write it directly.
+
+    Rows without an account are never coalesced (they do not conflict on uk_account).
+    """
+    if not insert_buffer.running or game.account is None:
+        return None
+    return insert_buffer.submit(game)
+
+def update_sql(game_name: str) -> str:
+    return f"""
+    UPDATE `{game_name}` 
     SET b_zone = :b_zone, s_zone = :s_zone, rating = :rating, online_time = :online_time
     WHERE account = :account
     """
-    db.execute(text(update_sql), {
+
+def update_params(game: BaseInfo, now: datetime) -> dict:
+    return {
         "b_zone": game.b_zone,
         "s_zone": game.s_zone,
         "rating": game.rating,
         "online_time": now,
         "account": game.account
-    })
+    }
+
+def update_game(db: Session, game: BaseInfo):
+    if not is_valid_game_name(game.game_name):
+        raise ValueError("Invalid game name")
+    
+    now = datetime.now()
+    db.execute(text(update_sql(game.game_name)), update_params(game, now))
     db.commit()
 
+def clear_talk_sql(game_name: str, field: str) -> str:
+    # Direct Update, Database handles locking
+    return f"UPDATE `{game_name}` SET {field} = '2000-01-01 00:00:00' WHERE id >= 0"
+
 def clear_talk_time(db: Session, game_name: str, talk_channel: int):
     if not is_valid_game_name(game_name):
         raise ValueError("Invalid game name")
@@ -123,16 +367,11 @@ def clear_talk_time(db: Session, game_name: str, talk_channel: int):
     if not field:
         return
 
-    # Direct Update, Database handles locking
-    sql = f"UPDATE `{game_name}` SET {field} = '2000-01-01 00:00:00' WHERE id >= 0"
-    db.execute(text(sql))
+    db.execute(text(clear_talk_sql(game_name, field)))
     db.commit()
 
-def query_game(db: Session, query: QueryReq):
-    if not is_valid_game_name(query.game_name):
-        raise ValueError("Invalid game name")
-    
-    # Build Query
+def build_query(query: QueryReq, now: datetime):
+    """SELECT for a query (without the locking clause), its parameters and the talk channel field."""
     sql_parts = [f"SELECT * FROM `{query.game_name}` WHERE 1=1"]
     params = {}
     
@@ -149,22 +388,49 @@ def query_game(db: Session, query: QueryReq):
         sql_parts.append("AND rating = :rating")
         params["rating"] = query.rating
         
-    now = datetime.now()
-    params["now"] = now
-    params["online_duration"] = query.online_duration
-    
+    # Cutoffs are computed here so the predicates compare the bare columns and
+    # can use TABLE_INDEXES. TIMESTAMPDIFF truncates to whole minutes, hence:
+    #   TIMESTAMPDIFF(MINUTE, online_time, now) < d  <=>  online_time > now - d min
+    #   TIMESTAMPDIFF(MINUTE, last_talk_timeX, now) > d  <=>  last_talk_timeX <= now - (d + 1) min
     if query.online_duration:
-        # TIMESTAMPDIFF(MINUTE, online_time, now) < online_duration
-        sql_parts.append("AND TIMESTAMPDIFF(MINUTE, online_time, :now) < :online_duration")
+        sql_parts.append("AND online_time > :online_cutoff")
+        params["online_cutoff"] = now - timedelta(minutes=query.online_duration)
         
     talk_channel_field = ""
     if query.talk_channel:
         talk_channel_field = get_talk_channel_field(query.talk_channel)
-        # TIMESTAMPDIFF(MINUTE, last_talk_timeX, now) > online_duration
-        sql_parts.append(f"AND TIMESTAMPDIFF(MINUTE, {talk_channel_field}, :now) > :online_duration")
+        sql_parts.append(f"AND {talk_channel_field} <= :talk_cutoff")
+        params["talk_cutoff"] = now - timedelta(minutes=query.online_duration + 1)
         
     limit = query.cnt if query.cnt else 1
     sql_parts.append(f"LIMIT {limit}")
+    return " ".join(sql_parts), params, talk_channel_field
+
+def is_skip_locked_unsupported(e: Exception) -> bool:
+    # Older MySQL versions (e.g. 5.7) reject SKIP LOCKED with a syntax error
+    return "syntax" in str(e).lower() or "1064" in str(e)
+
+def claim_update_sql(game_name: str, talk_channel_field: str, ids: list) -> str:
+    ids_placeholder = ", ".join([str(id) for id in ids]) 
+    return f"UPDATE `{game_name}` SET {talk_channel_field} = :now WHERE id IN ({ids_placeholder})"
+
+def to_base_info(row) -> BaseInfo:
+    return BaseInfo(
+        ID=row.id,
+        game_name=row.game_name,
+        account=row.account,
+        b_zone=row.b_zone,
+        s_zone=row.s_zone,
+        rating=row.rating
+    )
+
+def query_game(db: Session, query: QueryReq):
+    if not is_valid_game_name(query.game_name):
+        raise ValueError("Invalid game name")
+    
+    # Build Query
+    now = datetime.now()
+    select_sql, params, talk_channel_field = build_query(query, now)
     
     # Transaction for Read + Update
     # We want to return the list AND update their talk time.
@@ -172,16 +438,16 @@ def query_game(db: Session, query: QueryReq):
     # 1. We lock the rows we select, preventing other clients from selecting them (Avoid Double Booking).
     # 2. We skip rows locked by others, preventing waiting/blocking (Avoid Lag/Timeouts).
     
-    full_sql = " ".join(sql_parts) + " FOR UPDATE SKIP LOCKED"
+    full_sql = select_sql + " FOR UPDATE SKIP LOCKED"
     
     try:
         result = db.execute(text(full_sql), params).fetchall()
     except Exception as e:
         # Fallback for older MySQL versions (e.g. 5.7) that don't support SKIP LOCKED
         # If syntax error, try standard FOR UPDATE (which might block, but ensures consistency)
-        if "syntax" in str(e).lower() or "1064" in str(e):
+        if is_skip_locked_unsupported(e):
             print("Warning: SKIP LOCKED not supported, falling back to FOR UPDATE")
-            full_sql = " ".join(sql_parts) + " FOR UPDATE"
+            full_sql = select_sql + " FOR UPDATE"
             result = db.execute(text(full_sql), params).fetchall()
         else:
             raise e
@@ -190,22 +456,8 @@ def query_game(db: Session, query: QueryReq):
     if result and talk_channel_field:
         ids = [row.id for row in result]
         if ids:
-            ids_placeholder = ", ".join([str(id) for id in ids]) 
-            update_sql = f"UPDATE `{query.game_name}` SET {talk_channel_field} = :now WHERE id IN ({ids_placeholder})"
-            db.execute(text(update_sql), {"now": now})
+            db.execute(text(claim_update_sql(query.game_name, talk_channel_field, ids)), {"now": now})
             db.commit()
             
     # Map to schema
-    response_list = []
-    for row in result:
-        item = BaseInfo(
-            ID=row.id,
-            game_name=row.game_name,
-            account=row.account,
-            b_zone=row.b_zone,
-            s_zone=row.s_zone,
-            rating=row.rating
-        )
-        response_list.append(item)
-        
-    return response_list
+    return [to_base_info(row) for row in result]
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+from app.schemas.game import BaseInfo
+
+class InsertBuffer:
+    """Group commit for /insert (settings.INSERT_BUFFER), like the Go cache.go Insert/Refresh buffering.
+
+    Rows wait in a dict per game table keyed by account, so a later heartbeat
+    of the same account replaces the earlier one. A writer thread hands each
+    table's rows to `flush(game_name, rows)` every `interval_ms` or as soon as
+    a table holds `max_rows` accounts; every caller's future is resolved once
+    that write committed (or failed). A thread rather than an asyncio task so
+    the sync endpoints (threadpool) and the async ones share one buffer.
+    """
+
+    def __init__(self, flush: Callable[[str, List[BaseInfo]], None], interval_ms: int, max_rows: int):
+        self._flush = flush
+        self.interval = max(interval_ms, 1) / 1000
+        self.max_rows = max(max_rows, 1)
+        self._rows: Dict[str, Dict[str, BaseInfo]] = defaultdict(dict)
+        self._waiters: Dict[str, List[Future]] = defaultdict(list)
+        self._full = False
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="insert-buffer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Flush what is pending and stop the writer thread."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, game: BaseInfo) -> Future:
+        """Queue a row; the future completes when it has been written."""
+        future = Future()
+        with self._cond:
+            if self._stopping or self._thread is None:
+                raise RuntimeError("insert buffer is not running")
+            rows = self._rows[game.game_name]
+            rows[game.account] = game
+            self._waiters[game.game_name].append(future)
+            if len(rows) >= self.max_rows and not self._full:
+                self._full = True
+                self._cond.notify()
+        return future
+
+    def pending(self) -> Dict[str, int]:
+        with self._cond:
+            return {game_name: len(rows) for game_name, rows in self._rows.items()}
+
+    def _run(self):
+        deadline = time.monotonic() + self.interval
+        while True:
+            with self._cond:
+                while not self._stopping and not self._full:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                stopping = self._stopping
+                rows, self._rows = self._rows, defaultdict(dict)
+                waiters, self._waiters = self._waiters, defaultdict(list)
+                self._full = False
+            deadline = time.monotonic() + self.interval
+            for game_name, table_rows in rows.items():
+                self._write(game_name, list(table_rows.values()), waiters.pop(game_name, []))
+            if stopping:
+                return
+
+    def _write(self, game_name: str, rows: List[BaseInfo], waiters: List[Future]):
+        try:
+            self._flush(game_name, rows)
+        except Exception as e:
+            print(f"Warning: buffered insert of {len(rows)} rows into {game_name} failed: {e}")
+            for future in waiters:
+                future.set_exception(e)
+            return
+        for future in waiters:
+            future.set_result(None)
@@ -0,0 +1,188 @@
+import threading
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import bindparam, text
+from app.core.config import settings
+from app.core.database import engine
+from app.services.game_service import (
+    DEDUPE_INDEX,
+    INDEX_NAMES_SQL,
+    UNIQUE_KEY_RECHECK,
+    add_indexes_sql,
+    record_account_indexes,
+)
+
+# Tables with these columns are game tables (created by create_table or by the Go server)
+GAME_TABLES_SQL = """
+SELECT TABLE_NAME FROM information_schema.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND COLUMN_NAME IN ('account', 'online_time', 'last_talk_time6')
+GROUP BY TABLE_NAME HAVING COUNT(*) = 3
+"""
+
+# DEDUPE_INDEX is a temporary plain index on account: it makes the duplicate
+# scan cheap and switches insert_game to UPDATE-then-INSERT for the table, so no
+# new duplicates arrive while it is cleaned. Dropped once uk_account exists.
+# MySQL errors worth retrying: lock wait / metadata lock timeout, deadlock,
+# duplicate entry (a duplicate that still slipped in before uk_account was built)
+RETRY_ERRORS = ("1205", "1213", "1062")
+
+class SchemaMigrator:
+    """Brings existing game tables up to create_table's schema (settings.SCHEMA_MIGRATION).
+
+    Tables created by the old Go server lack `uk_account`, so insert_game's
+    ON DUPLICATE KEY UPDATE inserts a new row on every heartbeat. For each
+    game table found in information_schema this:
+      1. adds DEDUPE_INDEX and waits until every writer has seen it, after
+         which writes to the table no longer create duplicates;
+      2. removes duplicate accounts in chunks, keeping the row with the latest
+         online_time, one short transaction per chunk;
+      3. adds uk_account and the query indexes (TABLE_INDEXES) with
+         ALGORITHM=INPLACE, LOCK=NONE, so reads and writes continue.
+    Every step checks the current state first, so a run can be interrupted
+    and repeated. DDL waits at most MIGRATE_LOCK_WAIT_TIMEOUT seconds for the
+    table's metadata lock instead of queueing traffic behind it.
+    """
+
+    def __init__(self):
+        self.status: Dict[str, dict] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Migrate in a background thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.run, name="schema-migrator", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        try:
+            with engine.connect() as conn:
+                tables = [row[0] for row in conn.execute(text(GAME_TABLES_SQL))]
+                conn.commit()
+        except Exception as e:
+            print(f"Schema migration: cannot list game tables: {e}")
+            return
+        for table in tables:
+            self.status.setdefault(table, {"state": "pending", "duplicates_removed": 0, "error": None})
+        print(f"Schema migration: checking {len(tables)} game tables")
+        for table in tables:
+            self.migrate_table(table)
+        failed = [table for table in tables if self.status[table]["state"] == "failed"]
+        print(f"Schema migration: finished, {len(tables) - len(failed)} ok, {len(failed)} failed {failed or ''}")
+
+    def migrate_table(self, table: str):
+        status = self.status.setdefault(table, {"state": "pending", "duplicates_removed": 0, "error": None})
+        for attempt in range(1, settings.MIGRATE_RETRIES + 1):
+            try:
+                with engine.connect() as conn:
+                    previous = conn.execute(text("SELECT @@SESSION.lock_wait_timeout")).scalar()
+                    conn.execute(text(f"SET SESSION lock_wait_timeout = {int(settings.MIGRATE_LOCK_WAIT_TIMEOUT)}"))
+                    try:
+                        self._migrate(conn, table, status)
+                    finally:
+                        self._restore_lock_wait_timeout(conn, previous)
+                status["state"] = "done"
+                status["error"] = None
+                return
+            except Exception as e:
+                status["error"] = str(e)
+                if attempt < settings.MIGRATE_RETRIES and any(code in str(e) for code in RETRY_ERRORS):
+                    print(f"Schema migration: {table} attempt {attempt} failed ({e}), retrying")
+                    time.sleep(attempt * settings.MIGRATE_LOCK_WAIT_TIMEOUT)
+                    continue
+                status["state"] = "failed"
+                print(f"Schema migration: {table} failed: {e}")
+                return
+
+    def _migrate(self, conn, table: str, status: dict):
+        existing = self._index_names(conn, table)
+        if "uk_account" not in existing:
+            if DEDUPE_INDEX not in existing:
+                status["state"] = "indexing"
+                print(f"Schema migration: {table}: adding temporary index on account")
+                self._alter(conn, f"ALTER TABLE `{table}` ADD INDEX `{DEDUPE_INDEX}` (`account`), ALGORITHM=INPLACE, LOCK=NONE")
+                existing.add(DEDUPE_INDEX)
+                # This process switches at once; others when their cached lookup expires
+                record_account_indexes(table, existing)
+                status["state"] = "waiting for writers"
+                time.sleep(UNIQUE_KEY_RECHECK)
+            status["state"] = "deduplicating"
+            removed = self._dedupe(conn, table)
+            status["duplicates_removed"] += removed
+            status["state"] = "indexing"
+            print(f"Schema migration: {table}: {removed} duplicate rows removed, adding uk_account")
+            self._alter(conn, f"ALTER TABLE `{table}` ADD UNIQUE KEY `uk_account` (`account`), ALGORITHM=INPLACE, LOCK=NONE")
+            existing.add("uk_account")
+            record_account_indexes(table, existing)
+        if DEDUPE_INDEX in existing:
+            self._alter(conn, f"ALTER TABLE `{table}` DROP INDEX `{DEDUPE_INDEX}`, ALGORITHM=INPLACE, LOCK=NONE")
+        alter_sql = add_indexes_sql(table, existing)
+        if alter_sql:
+            status["state"] = "indexing"
+            print(f"Schema migration: {table}: adding query indexes")
+            self._alter(conn, alter_sql)
+
+    def _restore_lock_wait_timeout(self, conn, previous):
+        # The connection goes back to the pool with its session variables, and request
+        # sessions must not inherit the short timeout; one that cannot be reset is discarded
+        try:
+            conn.rollback()
+            conn.execute(text(f"SET SESSION lock_wait_timeout = {int(previous)}"))
+            conn.commit()
+        except Exception as e:
+            print(f"Schema migration: cannot restore lock_wait_timeout ({e}), discarding the connection")
+            conn.invalidate()
+
+    def _index_names(self, conn, table: str) -> set:
+        names = {row[0] for row in conn.execute(text(INDEX_NAMES_SQL), {"table_name": table})}
+        conn.commit()
+        return names
+
+    def _alter(self, conn, sql: str):
+        start = time.perf_counter()
+        conn.execute(text(sql))
+        conn.commit()
+        print(f"Schema migration:   done in {time.perf_counter() - start:.1f}s")
+
+    def _dedupe(self, conn, table: str) -> int:
+        """Delete all but the newest row of each duplicated account; returns the rows deleted."""
+        duplicates = f"""
+        SELECT account FROM `{table}` WHERE account IS NOT NULL {{}}
+        GROUP BY account HAVING COUNT(*) > 1 ORDER BY account LIMIT :chunk
+        """
+        first_sql = text(duplicates.format(""))
+        next_sql = text(duplicates.format("AND account > :after"))
+        # Compared by MySQL, so accounts equal under the column's collation
+        # (which is what uk_account enforces) are handled as one
+        rows_sql = text(f"SELECT id FROM `{table}` WHERE account = :account ORDER BY online_time DESC, id DESC")
+        delete_sql = text(f"DELETE FROM `{table}` WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+
+        removed = 0
+        after = None
+        while True:
+            # Accounts are visited in order, so each chunk starts after the previous one
+            if after is None:
+                accounts = [row[0] for row in conn.execute(first_sql, {"chunk": settings.MIGRATE_CHUNK_SIZE})]
+            else:
+                accounts = [row[0] for row in conn.execute(next_sql, {"after": after, "chunk": settings.MIGRATE_CHUNK_SIZE})]
+            if not accounts:
+                conn.commit()
+                return removed
+            stale: List[int] = []
+            for account in accounts:
+                ids = [row[0] for row in conn.execute(rows_sql, {"account": account})]
+                stale.extend(ids[1:])
+            if stale:
+                conn.execute(delete_sql, {"ids": stale})
+            conn.commit()
+            removed += len(stale)
+            after = accounts[-1]
+            print(f"Schema migration: {table}: {removed} duplicate rows removed (up to account {after!r})")
+
+    def stats(self) -> dict:
+        return {table: dict(status) for table, status in self.status.items()}
+
+migrator = SchemaMigrator()
+
+if __name__ == "__main__":
+    # One foreground run: python -m app.services.migrator
+    migrator.run()
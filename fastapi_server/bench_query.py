@@ -0,0 +1,107 @@
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from app.core.database import engine
+from app.schemas.game import QueryReq
+from app.services import game_service
+
+# SELECT latency of query_game with the old TIMESTAMPDIFF predicates and the
+# precomputed cutoffs, on a table with the query indexes. Runs against the
+# MySQL-compatible server configured in .env (MySQL, MariaDB, TiDB, ...);
+# the table is dropped and reloaded on every run.
+# Usage: python bench_query.py [rows] [repeats]
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+TABLE = "bench_query"
+LOAD_CHUNK = 5000
+B_ZONES = 20
+S_ZONES = 50
+
+QUERIES = {
+    "online": QueryReq(game_name=TABLE, online_duration=10, cnt=50),
+    "zone+online": QueryReq(game_name=TABLE, b_zone="3", s_zone="7", online_duration=10, cnt=50),
+    "online+talk": QueryReq(game_name=TABLE, online_duration=10, talk_channel=2, cnt=50),
+}
+
+def legacy_query(query: QueryReq, now: datetime):
+    """query_game's SELECT before the cutoffs were precomputed."""
+    sql_parts = [f"SELECT * FROM `{query.game_name}` WHERE 1=1"]
+    params = {"now": now, "online_duration": query.online_duration}
+    if query.b_zone:
+        sql_parts.append("AND b_zone = :b_zone")
+        params["b_zone"] = query.b_zone
+    if query.s_zone:
+        sql_parts.append("AND s_zone = :s_zone")
+        params["s_zone"] = query.s_zone
+    if query.online_duration:
+        sql_parts.append("AND TIMESTAMPDIFF(MINUTE, online_time, :now) < :online_duration")
+    if query.talk_channel:
+        field = game_service.get_talk_channel_field(query.talk_channel)
+        sql_parts.append(f"AND TIMESTAMPDIFF(MINUTE, {field}, :now) > :online_duration")
+    sql_parts.append(f"LIMIT {query.cnt or 1}")
+    return " ".join(sql_parts), params
+
+def load(conn):
+    conn.execute(text(f"DROP TABLE IF EXISTS `{TABLE}`"))
+    conn.execute(text(game_service.create_table_sql(TABLE)))
+    insert_sql = text(f"""
+    INSERT INTO `{TABLE}` (game_name, account, b_zone, s_zone, rating, online_time, last_talk_time2)
+    VALUES (:game_name, :account, :b_zone, :s_zone, :rating, :online_time, :last_talk_time2)
+    """)
+    now = datetime.now()
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for first in range(0, ROWS, LOAD_CHUNK):
+        rows = []
+        for i in range(first, min(first + LOAD_CHUNK, ROWS)):
+            # Heartbeats spread over a day, so a 10 minute window matches ~0.7% of the rows
+            rows.append({
+                "game_name": TABLE,
+                "account": f"user_{i}",
+                "b_zone": str(rng.randrange(B_ZONES)),
+                "s_zone": str(rng.randrange(S_ZONES)),
+                "rating": rng.randrange(100),
+                "online_time": now - timedelta(seconds=rng.randrange(86400)),
+                "last_talk_time2": now - timedelta(seconds=rng.randrange(86400)),
+            })
+        conn.execute(insert_sql, rows)
+        conn.commit()
+    conn.execute(text(f"ANALYZE TABLE `{TABLE}`"))
+    conn.commit()
+    print(f"loaded {ROWS} rows in {time.perf_counter() - start:.1f}s")
+
+def measure(conn, sql: str, params: dict) -> float:
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def plan(conn, sql: str, params: dict) -> str:
+    row = conn.execute(text("EXPLAIN " + sql), params).mappings().first()
+    return f"key={row.get('key')} rows={row.get('rows')}"
+
+def main():
+    with engine.connect() as conn:
+        load(conn)
+        print(f"{'query':<14}{'old ms':>10}{'new ms':>10}  plans (old | new)")
+        for name, query in QUERIES.items():
+            now = datetime.now()
+            old_sql, old_params = legacy_query(query, now)
+            new_sql, new_params, _ = game_service.build_query(query, now)
+            old_rows = conn.execute(text(old_sql.replace(" LIMIT", " ORDER BY id LIMIT")), old_params).fetchall()
+            new_rows = conn.execute(text(new_sql.replace(" LIMIT", " ORDER BY id LIMIT")), new_params).fetchall()
+            if [r.id for r in old_rows] != [r.id for r in new_rows]:
+                raise RuntimeError(f"{name}: old and new predicates select different rows")
+            old_ms = measure(conn, old_sql, old_params)
+            new_ms = measure(conn, new_sql, new_params)
+            print(f"{name:<14}{old_ms:>10.2f}{new_ms:>10.2f}  {plan(conn, old_sql, old_params)} | {plan(conn, new_sql, new_params)}")
+        conn.execute(text(f"DROP TABLE IF EXISTS `{TABLE}`"))
+
+if __name__ == "__main__":
+    main()
@@ -45,6 +45,8 @@ def build_executable():
         '--hidden-import=uvicorn.lifespan',
         '--hidden-import=uvicorn.lifespan.on',
         '--hidden-import=pymysql',
+        '--hidden-import=aiomysql',
+        '--hidden-import=sqlalchemy.dialects.mysql.aiomysql',
         '--hidden-import=tzdata',
         
         # 排除不必要的包，减少 "module not found" 警告
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# CPU time per request for /insert, /update and /query with the pydantic
+# routes (Config.FAST_PATH = False) and the fast path. Each mode runs in its
+# own process against a fresh data directory; requests are driven straight
+# through the ASGI app, so no HTTP client or socket time is included.
+# Usage: python bench_fastpath.py [requests_per_route]
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 5000
+GAME = "bench_fast"
+ACCOUNTS = 1000
+QUERY_CNT = 50
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+async def call(app, path: str, body: bytes) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+def bodies(route: str):
+    for i in range(ROUNDS):
+        if route == "/query":
+            body = {"game_name": GAME, "online_duration": 10, "b_zone": "1", "s_zone": "2", "cnt": QUERY_CNT}
+        else:
+            body = {"game_name": GAME, "account": f"user_{i % ACCOUNTS}", "b_zone": "1", "s_zone": "2", "rating": i}
+        yield json.dumps(body).encode()
+
+async def run_mode():
+    from src.api import app, startup_event, shutdown_event
+    from src.logic import logic_service
+    await startup_event()
+    await logic_service.new_game(GAME)
+    for body in bodies("/insert"):
+        await call(app, "/insert", body)
+    results = {}
+    for route in ("/insert", "/update", "/query"):
+        payloads = list(bodies(route))
+        start = time.process_time()
+        for body in payloads:
+            status = await call(app, route, body)
+            if status != 200:
+                raise RuntimeError(f"{route} returned {status}")
+        results[route] = (time.process_time() - start) / ROUNDS * 1e6
+    await shutdown_event()
+    print(json.dumps(results))
+
+def measure(fast: bool) -> dict:
+    data_dir = tempfile.mkdtemp(prefix="bench_fast_")
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, BENCH_FAST_PATH="1" if fast else "0")
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), str(ROUNDS), "--child"],
+                         cwd=data_dir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    print(f"{ROUNDS} requests per route, /query returns {QUERY_CNT} rows")
+    before = measure(fast=False)
+    after = measure(fast=True)
+    print(f"{'route':<10}{'pydantic us':>14}{'fast path us':>14}{'saved':>8}")
+    for route in before:
+        print(f"{route:<10}{before[route]:>14.1f}{after[route]:>14.1f}{1 - after[route] / before[route]:>8.0%}")
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        import logging
+        logging.disable(logging.INFO)
+        from src.config import config
+        config.FAST_PATH = os.environ["BENCH_FAST_PATH"] == "1"
+        config.MAINTENANCE_ENABLED = False
+        asyncio.run(run_mode())
+    else:
+        main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from src.config import config
+from src.database import auto_migrate, get_connection, upgrade_schema
+
+# Compares the hot /query shapes on a synthetic table with the original
+# indexes and with the advised composite indexes (Config.ADVISED_INDEXES).
+# Usage: python bench_indexes.py [rows]
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+GAME = "bench_idx"
+ZONES = 20
+ROUNDS = 200
+FMT = "%Y-%m-%d %H:%M:%S"
+
+QUERIES = {
+    "zone + online + talk": (
+        f'SELECT * FROM "{GAME}" WHERE b_zone = ? AND s_zone = ? AND online_time > ? AND last_talk_time1 < ? LIMIT 5',
+        lambda cutoff: (str(random.randrange(ZONES)), str(random.randrange(ZONES)), cutoff, cutoff),
+    ),
+    "online + talk": (
+        f'SELECT * FROM "{GAME}" WHERE online_time > ? AND last_talk_time1 < ? LIMIT 5',
+        lambda cutoff: (cutoff, cutoff),
+    ),
+    "zone + online": (
+        f'SELECT * FROM "{GAME}" WHERE b_zone = ? AND s_zone = ? AND online_time > ? LIMIT 5',
+        lambda cutoff: (str(random.randrange(ZONES)), str(random.randrange(ZONES)), cutoff),
+    ),
+}
+
+def populate(conn):
+    now = datetime.now()
+    old = "2000-01-01 00:00:00"
+
+    def rows():
+        for i in range(ROWS):
+            # Most accounts went offline long ago; a few percent were seen in the last 10 minutes
+            online = now - timedelta(minutes=random.randrange(10) if i % 30 == 0 else random.randrange(10, 60 * 24 * 30))
+            talked = (now - timedelta(minutes=random.randrange(5))).strftime(FMT) if random.random() < 0.3 else old
+            yield (GAME, f"user_{i}", str(random.randrange(ZONES)), str(random.randrange(ZONES)), 1,
+                   online.strftime(FMT), online.strftime(FMT), talked)
+
+    conn.execute("BEGIN")
+    conn.executemany(
+        f'INSERT INTO "{GAME}" (game_name, account, b_zone, s_zone, rating, online_time, created_at, last_talk_time1) '
+        f'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows())
+    conn.commit()
+    conn.execute(f'ANALYZE "{GAME}"')
+
+def measure(conn, label):
+    cutoff = (datetime.now() - timedelta(minutes=10)).strftime(FMT)
+    print(f"\n--- {label} ---")
+    for name, (sql, make_params) in QUERIES.items():
+        plan = " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, make_params(cutoff)))
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            conn.execute(sql, make_params(cutoff)).fetchall()
+        avg_ms = (time.perf_counter() - start) * 1000 / ROUNDS
+        print(f"{name:<22} {avg_ms:8.3f} ms  {plan}")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as data_dir:
+        config.DATA_DIR = data_dir
+        config.ADVISED_INDEXES = False
+        auto_migrate(GAME)
+        conn = get_connection(GAME)
+        print(f"Populating {ROWS} rows...")
+        populate(conn)
+        measure(conn, "original indexes")
+
+        config.ADVISED_INDEXES = True
+        start = time.perf_counter()
+        upgrade_schema(conn, GAME)
+        print(f"\nAdvised indexes built in {time.perf_counter() - start:.1f}s")
+        measure(conn, "advised indexes")
+        size_mb = os.path.getsize(config.get_db_path(GAME)) / 1024 / 1024
+        print(f"\nDatabase size: {size_mb:.0f} MB")
+        conn.close()
@@ -0,0 +1,97 @@
+import os
+import sys
+import subprocess
+import tempfile
+import threading
+import time
+import requests
+
+# Throughput scaling of the server from 1 to MAX_WORKERS uvicorn workers.
+# Each run starts a fresh server in a temporary data directory, drives a mix
+# of /insert and talk-channel /query claims, and checks that no account was
+# handed out twice within the claim window (which would mean the claim
+# protocol is not atomic across worker processes).
+
+PORT = 9197
+BASE_URL = f"http://127.0.0.1:{PORT}"
+MAX_WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+GAMES = 10
+ACCOUNTS_PER_GAME = 500
+CONCURRENCY = 50
+DURATION = 10  # Seconds per run
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def start_server(workers, data_dir):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1",
+         "--port", str(PORT), "--workers", str(workers), "--log-level", "warning"],
+        cwd=data_dir, env=env,
+    )
+    for _ in range(100):
+        try:
+            requests.get(f"{BASE_URL}/docs", timeout=0.5)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+def setup():
+    session = requests.Session()
+    for g in range(GAMES):
+        game_name = f"bench_{g}"
+        session.post(f"{BASE_URL}/createNewGame", json={"game_name": game_name})
+        for i in range(ACCOUNTS_PER_GAME):
+            session.post(f"{BASE_URL}/insert", json={
+                "game_name": game_name, "account": f"user_{i}", "b_zone": "1", "s_zone": "1", "rating": 1
+            })
+
+def worker(thread_id, deadline, counts, claimed):
+    session = requests.Session()
+    game_name = f"bench_{thread_id % GAMES}"
+    n = 0
+    i = 0
+    while time.time() < deadline:
+        i += 1
+        if i % 2:
+            res = session.post(f"{BASE_URL}/insert", json={
+                "game_name": game_name, "account": f"user_{i % ACCOUNTS_PER_GAME}",
+                "b_zone": "1", "s_zone": "1", "rating": 1
+            })
+        else:
+            # A long window means each account can be claimed at most once per run
+            res = session.post(f"{BASE_URL}/query", json={
+                "game_name": game_name, "online_duration": 60, "talk_channel": 1, "cnt": 5
+            })
+            if res.status_code == 200:
+                claimed.extend((game_name, row["account"]) for row in res.json()["data"] or [])
+        if res.status_code == 200:
+            n += 1
+    counts[thread_id] = n
+
+def run(workers):
+    with tempfile.TemporaryDirectory() as data_dir:
+        proc = start_server(workers, data_dir)
+        try:
+            setup()
+            counts = [0] * CONCURRENCY
+            claimed = []
+            deadline = time.time() + DURATION
+            threads = [threading.Thread(target=worker, args=(i, deadline, counts, claimed)) for i in range(CONCURRENCY)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            proc.terminate()
+            proc.wait()
+    duplicates = len(claimed) - len(set(claimed))
+    return sum(counts) / DURATION, duplicates
+
+if __name__ == "__main__":
+    print(f"{'workers':>8} {'req/s':>10} {'dup claims':>11}")
+    for workers in range(1, MAX_WORKERS + 1):
+        throughput, duplicates = run(workers)
+        print(f"{workers:>8} {throughput:>10.1f} {duplicates:>11}")
@@ -0,0 +1,72 @@
+import glob
+import os
+import sys
+from src.config import config
+from src.database import base_indexes, connect, create_table_sql, is_epoch_table, upgrade_schema
+
+# Converts game tables under DATA_DIR from text timestamps to the INTEGER
+# epoch schema (Config.EPOCH_TIMESTAMPS). Stop the server before running it:
+# the server caches each table's schema.
+# Usage: python migrate_epoch.py [game_name ...]   (default: every game)
+
+TALK_COLUMNS = [f"last_talk_time{channel}" for channel in range(1, 7)]
+
+def to_epoch(column: str, sentinel: bool = False) -> str:
+    """SQL expression converting a local 'YYYY-MM-DD HH:MM:SS' column to epoch seconds."""
+    expr = f"CAST(strftime('%s', {column}, 'utc') AS INTEGER)"
+    if sentinel:
+        # '2000-01-01 00:00:00' (or older) means never talked, which is 0 in the epoch schema
+        expr = f"CASE WHEN {column} <= '2000-01-01 00:00:00' THEN 0 ELSE {expr} END"
+    return expr
+
+def migrate_table(conn, game_name: str) -> bool:
+    if is_epoch_table(conn, game_name) is not False:
+        return False
+    tmp_name = f"{game_name}__epoch"
+    columns = ["id", "created_at", "online_time", "game_name", "account", "b_zone", "s_zone", "rating"] + TALK_COLUMNS
+    select = ["id", to_epoch("created_at"), to_epoch("online_time"), "game_name", "account", "b_zone", "s_zone", "rating"]
+    select += [to_epoch(column, sentinel=True) for column in TALK_COLUMNS]
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f'DROP TABLE IF EXISTS "{tmp_name}"')
+        conn.execute(create_table_sql(game_name, epoch=True, table_name=tmp_name))
+        conn.execute(
+            f'INSERT INTO "{tmp_name}" ({", ".join(columns)}) SELECT {", ".join(select)} FROM "{game_name}"'
+        )
+        conn.execute(f'DROP TABLE "{game_name}"')
+        conn.execute(f'ALTER TABLE "{tmp_name}" RENAME TO "{game_name}"')
+        for idx_sql in base_indexes(game_name):
+            conn.execute(idx_sql)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = '_talk_resets'").fetchone():
+            # Talk channel reset times are kept in the table's time representation
+            conn.execute(
+                f"UPDATE _talk_resets SET reset_at = {to_epoch('reset_at')} "
+                "WHERE game_name = ? AND typeof(reset_at) = 'text'", (game_name,)
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    upgrade_schema(conn, game_name)
+    return True
+
+def main(games):
+    for db_path in sorted(glob.glob(os.path.join(config.DATA_DIR, "*.db"))):
+        conn = connect(db_path)
+        try:
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )]
+            converted = [t for t in tables if (not games or t in games) and migrate_table(conn, t)]
+            if converted:
+                before = os.path.getsize(db_path)
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                after = os.path.getsize(db_path)
+                print(f"{db_path}: converted {', '.join(converted)} ({before // 1024} KB -> {after // 1024} KB)")
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    main(set(sys.argv[1:]))
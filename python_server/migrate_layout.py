@@ -0,0 +1,86 @@
+import glob
+import os
+import sys
+from src.catalog import Catalog
+from src.config import config
+from src.database import TALK_RESETS_SQL, base_indexes, connect, create_table_sql, is_epoch_table, upgrade_schema
+
+# Moves per-game database files (DATA_DIR/{game}.db) into the shared layout
+# (Config.STORAGE_LAYOUT = "shared" with SHARD_COUNT shard files). Stop the
+# server before running it. Each source file is renamed to {game}.db.migrated
+# once its rows are copied and counted; delete those after checking the
+# server on the new layout. Games registered with a durability profile other
+# than DEFAULT_PROFILE keep their own file and are skipped.
+# Usage: python migrate_layout.py [game_name ...]   (default: every game)
+
+def source_files(games):
+    """Per-game files under DATA_DIR: {game}.db holding a table named {game}."""
+    catalog = Catalog()
+    for db_path in sorted(glob.glob(os.path.join(config.DATA_DIR, "*.db"))):
+        game_name = os.path.basename(db_path)[:-len(".db")]
+        if games and game_name not in games:
+            continue
+        if catalog.read(game_name) not in (None, config.DEFAULT_PROFILE):
+            continue
+        if os.path.abspath(config.get_db_path(game_name)) == os.path.abspath(db_path):
+            continue  # Already the shard this game maps to
+        conn = connect(db_path)
+        try:
+            epoch = is_epoch_table(conn, game_name)
+            # Leave the WAL empty so the rename below moves everything
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        if epoch is not None:
+            yield db_path, game_name, epoch
+
+def migrate_game(src_path: str, game_name: str, epoch: bool) -> int:
+    conn = connect(config.get_db_path(game_name))
+    conn.isolation_level = None
+    try:
+        conn.execute("ATTACH DATABASE ? AS src", (src_path,))
+        columns = ", ".join(row[1] for row in conn.execute(f'PRAGMA src.table_info("{game_name}")'))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Not is_epoch_table(): unqualified PRAGMA table_info would also find the attached source
+            if conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                            (game_name,)).fetchone():
+                raise RuntimeError(f"{game_name} already exists in {config.get_db_path(game_name)}")
+            conn.execute(create_table_sql(game_name, epoch=epoch))
+            conn.execute(f'INSERT INTO main."{game_name}" ({columns}) SELECT {columns} FROM src."{game_name}"')
+            copied = conn.execute(f'SELECT COUNT(*) FROM main."{game_name}"').fetchone()[0]
+            expected = conn.execute(f'SELECT COUNT(*) FROM src."{game_name}"').fetchone()[0]
+            if copied != expected:
+                raise RuntimeError(f"{game_name}: copied {copied} rows, expected {expected}")
+            for idx_sql in base_indexes(game_name):
+                conn.execute(idx_sql)
+            if conn.execute("SELECT 1 FROM src.sqlite_master WHERE name = '_talk_resets'").fetchone():
+                # Pending talk channel resets move with the game
+                conn.execute(TALK_RESETS_SQL)
+                conn.execute(
+                    "INSERT OR REPLACE INTO main._talk_resets SELECT * FROM src._talk_resets WHERE game_name = ?",
+                    (game_name,),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("DETACH DATABASE src")
+        upgrade_schema(conn, game_name)
+    finally:
+        conn.close()
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(src_path + suffix):
+            os.remove(src_path + suffix)
+    os.rename(src_path, src_path + ".migrated")
+    return copied
+
+def main(games):
+    if config.STORAGE_LAYOUT != "shared":
+        sys.exit('Set Config.STORAGE_LAYOUT = "shared" (and SHARD_COUNT) first')
+    for db_path, game_name, epoch in list(source_files(games)):
+        rows = migrate_game(db_path, game_name, epoch)
+        print(f"{game_name}: {rows} rows -> {config.get_db_path(game_name)}")
+
+if __name__ == "__main__":
+    main(set(sys.argv[1:]))
@@ -1,7 +1,10 @@
 import uvicorn
 from src.config import config
+from src.metrics import worker_sync
 
 if __name__ == "__main__":
     # Increase workers to handle concurrency better
-    print(f"Starting server on port {config.HTTP_PORT} with 4 workers...")
-    uvicorn.run("src.main:app", host="0.0.0.0", port=config.HTTP_PORT, reload=False, workers=4)
+    print(f"Starting server on port {config.HTTP_PORT} with {config.WORKERS} workers...")
+    # Metrics files of the previous run's workers would otherwise stay in the sums
+    worker_sync.clear()
+    uvicorn.run("src.main:app", host="0.0.0.0", port=config.HTTP_PORT, reload=False, workers=config.WORKERS)
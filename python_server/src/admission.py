@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict
+from .config import config
+from .metrics import STAGE_SECONDS, set_request_game
+
+class Overloaded(Exception):
+    """A game's wait queue is full or its wait timed out; the API answers 429."""
+
+class GameGate:
+    __slots__ = ("active", "waiters", "admitted", "rejected", "max_depth")
+
+    def __init__(self):
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.max_depth = 0
+
+class AdmissionController:
+    """Per-game concurrency limits in front of LogicService.
+
+    At most `max_concurrency` requests of a game run at once. Further
+    requests wait in a FIFO queue of at most `max_queue` entries for up to
+    `wait_timeout` seconds; a full queue or an expired wait raises
+    Overloaded straight away, so a flooded game sheds load instead of
+    piling up work that delays every other game in the worker.
+    Only used from the event loop.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, wait_timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.wait_timeout = wait_timeout
+        self._gates: Dict[str, GameGate] = {}
+
+    async def run(self, game_name: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Await fn(*args) once the game has a free slot."""
+        set_request_game(game_name)
+        async with self.slot(game_name):
+            return await self._timed(game_name, fn, *args)
+
+    @asynccontextmanager
+    async def slot(self, game_name: str) -> AsyncIterator[None]:
+        """Hold one of the game's slots, for requests that touch several games (batches)."""
+        if not config.ADMISSION_ENABLED:
+            yield
+            return
+        gate = self._gates.get(game_name)
+        if gate is None:
+            gate = self._gates[game_name] = GameGate()
+        start = time.perf_counter()
+        try:
+            await self._acquire(game_name, gate)
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, "admission", game_name)
+        try:
+            yield
+        finally:
+            self._release(gate)
+
+    async def _timed(self, game_name: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        start = time.perf_counter()
+        try:
+            return await fn(*args)
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, "logic", game_name)
+
+    async def _acquire(self, game_name: str, gate: GameGate):
+        if gate.active < self.max_concurrency and not gate.waiters:
+            gate.active += 1
+            gate.admitted += 1
+            return
+        if len(gate.waiters) >= self.max_queue:
+            gate.rejected += 1
+            raise Overloaded(f"too many pending requests for {game_name}")
+
+        waiter = asyncio.get_running_loop().create_future()
+        gate.waiters.append(waiter)
+        gate.max_depth = max(gate.max_depth, len(gate.waiters))
+        try:
+            # A released slot is handed over by completing the waiter, so `active` is unchanged
+            await asyncio.wait_for(waiter, self.wait_timeout)
+        except asyncio.TimeoutError:
+            gate.rejected += 1
+            raise Overloaded(f"timed out waiting for {game_name}")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the client went away; pass it on
+                self._release(gate)
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    gate.waiters.remove(waiter)
+                except ValueError:
+                    pass
+        gate.admitted += 1
+
+    def _release(self, gate: GameGate):
+        while gate.waiters:
+            waiter = gate.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        gate.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            game_name: {
+                "active": gate.active,
+                "queued": len(gate.waiters),
+                "max_queued": gate.max_depth,
+                "admitted": gate.admitted,
+                "rejected": gate.rejected,
+            }
+            for game_name, gate in self._gates.items()
+        }
+
+admission = AdmissionController(config.GAME_MAX_CONCURRENCY, config.GAME_MAX_QUEUE, config.ADMISSION_WAIT_TIMEOUT)
@@ -1,14 +1,21 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
-from .models import BaseInfo, QueryReq
+from typing import List
+from .models import BaseInfo, NewGameReq, QueryReq
 from .logic import logic_service
+from .admission import admission, Overloaded
+from .config import config
+from .fastpath import FastBaseInfo, FastQueryReq, dumps, json_response, parse
 from .database import init_db
+from .metrics import MetricsMiddleware, register_service_gauges, render_all, worker_sync
 import logging
 
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+register_service_gauges(logic_service, admission)
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -28,47 +35,196 @@ async def general_exception_handler(request: Request, exc: Exception):
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    logic_service.start()
+    if config.METRICS_ENABLED and config.WORKERS > 1:
+        worker_sync.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Flush buffered write-behind rows before the worker exits
+    await logic_service.stop()
+    worker_sync.stop()
+
+# Config.FAST_PATH: /insert, /update and /query read the body with a JSON decoder into
+# __slots__ structs and answer with pre-serialized bytes, skipping pydantic and
+# jsonable_encoder. Registered before the regular routes below, which then only
+# describe the request bodies in the OpenAPI docs.
+fast_routes = APIRouter()
+NDJSON = "application/x-ndjson"
+INSERT_SUCCESS = dumps({"message": "insert success"})
+UPDATE_SUCCESS = dumps({"message": "update success"})
+
+@fast_routes.post("/insert")
+async def fast_insert(request: Request):
+    base = parse(await request.body(), FastBaseInfo)
+    try:
+        await admission.run(base.GameName, logic_service.insert, base)
+        return json_response(INSERT_SUCCESS)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@fast_routes.post("/update")
+async def fast_update(request: Request):
+    base = parse(await request.body(), FastBaseInfo)
+    try:
+        await admission.run(base.GameName, logic_service.update, base)
+        return json_response(UPDATE_SUCCESS)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@fast_routes.post("/query")
+async def fast_query(request: Request):
+    req = parse(await request.body(), FastQueryReq)
+    try:
+        if req.OnlineDuration == 0:
+            raise HTTPException(status_code=400, detail="在线时长不能为0")
+
+        if NDJSON in request.headers.get("accept", ""):
+            return await _stream_query(req)
+
+        data = await admission.run(req.GameName, logic_service.query, req)
+        return json_response({"message": "query success", "data": data})
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+if config.FAST_PATH:
+    app.include_router(fast_routes, include_in_schema=False)
 
 @app.post("/createNewGame")
-async def create_new_game(base: BaseInfo):
+async def create_new_game(base: NewGameReq):
     try:
-        logic_service.new_game(base.GameName)
+        await admission.run(base.GameName, logic_service.new_game, base.GameName, base.Profile)
         return {"message": "create new game table success"}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/insert")
 async def insert(base: BaseInfo):
     try:
-        logic_service.insert(base)
+        await admission.run(base.GameName, logic_service.insert, base)
         return {"message": "insert success"}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/update")
 async def update(base: BaseInfo):
     try:
-        logic_service.update(base)
+        await admission.run(base.GameName, logic_service.update, base)
         return {"message": "update success"}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/insertBatch")
+async def insert_batch(bases: List[BaseInfo]):
+    # Rows may span games; each game is written in one transaction and
+    # "data" carries a status per row in request order (/updateBatch reports
+    # accounts that do not exist as errors). Every game passes its admission
+    # gate; rows of a game that is shed get the 429 reason as their error
+    try:
+        data = await logic_service.insert_batch(bases, admission.slot)
+        return {"message": "insert success", "data": data}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/updateBatch")
+async def update_batch(bases: List[BaseInfo]):
+    try:
+        data = await logic_service.update_batch(bases, admission.slot)
+        return {"message": "update success", "data": data}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/query")
-async def query(req: QueryReq):
+async def query(req: QueryReq, request: Request):
     try:
         if req.OnlineDuration == 0:
             raise HTTPException(status_code=400, detail="在线时长不能为0")
-        
-        data = logic_service.query(req)
+
+        if NDJSON in request.headers.get("accept", ""):
+            return await _stream_query(req)
+
+        data = await admission.run(req.GameName, logic_service.query, req)
         return {"message": "query success", "data": data}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+async def _stream_query(req) -> StreamingResponse:
+    batches = logic_service.query_stream(req)
+    # The first batch runs before the response starts, so its errors still get a status code
+    first = await admission.run(req.GameName, batches.__anext__)
+    return StreamingResponse(_ndjson_rows(req.GameName, batches, first), media_type=NDJSON)
+
+async def _ndjson_rows(game_name: str, batches, rows: List[dict]):
+    """One JSON object per line. An error after the first batch ends the stream with an {"error": ...} line."""
+    try:
+        while True:
+            if rows:
+                yield b"".join(dumps(row) + b"\n" for row in rows)
+            rows = await admission.run(game_name, batches.__anext__)
+    except StopAsyncIteration:
+        pass
+    except Exception as e:
+        logger.error(f"Streaming query for {game_name} failed: {e}")
+        yield dumps({"error": str(e)}) + b"\n"
+    finally:
+        await batches.aclose()
+
+@app.post("/explain")
+async def explain(req: QueryReq):
+    # Debug aid: shows which index a /query with the same body would use
+    try:
+        data = await admission.run(req.GameName, logic_service.explain, req)
+        return {"message": "query success", "data": data}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/statementCacheStats")
+async def statement_cache_stats():
+    return {"message": "query success", "data": logic_service.statements.stats()}
+
+@app.get("/connectionStats")
+async def connection_stats():
+    # Open database handles against MAX_OPEN_GAMES, and how often idle ones were evicted
+    return {"message": "query success", "data": logic_service.connections.stats()}
+
+@app.get("/maintenanceStats")
+async def maintenance_stats():
+    # Checkpoint/optimize/vacuum counters and the last seen WAL size per open database
+    return {"message": "query success", "data": logic_service.maintenance.stats()}
+
+@app.get("/admissionStats")
+async def admission_stats():
+    # Per-game running and queued requests, and how many were shed with 429
+    return {"message": "query success", "data": admission.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text exposition, summed over all worker processes
+    return PlainTextResponse(render_all(), media_type="text/plain; version=0.0.4")
+
 @app.post("/clearTalkChannel")
 async def clear_talk_channel(req: QueryReq):
     # Note: Go version uses QueryReq structure but only reads GameName and TalkChannel
     try:
-        logic_service.clear_talk_time(req.GameName, req.TalkChannel)
+        await admission.run(req.GameName, logic_service.clear_talk_time, req.GameName, req.TalkChannel)
         return {"message": "clear talk time channel success"}
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional
+from .config import config
+from .database import connect
+
+CATALOG_FILE = "_catalog.db"
+# Games without an entry are looked up again after this many seconds, so a
+# profile registered by another worker process is picked up
+UNREGISTERED_RECHECK = 5.0
+UNREGISTERED_LIMIT = 10000
+
+CATALOG_SQL = """
+    CREATE TABLE IF NOT EXISTS game_profiles (
+        game_name TEXT PRIMARY KEY,
+        profile TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+class Catalog:
+    """Durability profile of each game (Config.DURABILITY_PROFILES), kept in DATA_DIR/_catalog.db.
+
+    A profile is chosen when the game is created and never changes, so
+    registered games are cached for good. Games without an entry (created
+    without a profile, or before profiles existed) use DEFAULT_PROFILE.
+    Lookups that miss the cache run on the default executor.
+    """
+
+    def __init__(self):
+        self._profiles: Dict[str, str] = {}
+        self._unregistered: Dict[str, float] = {}
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """The catalog connection, created on first use. Caller holds self._lock."""
+        if self._conn is None:
+            os.makedirs(config.DATA_DIR, exist_ok=True)
+            conn = connect(os.path.join(config.DATA_DIR, CATALOG_FILE))
+            conn.execute(CATALOG_SQL)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def read(self, game_name: str) -> Optional[str]:
+        """Uncached, blocking lookup of the registered profile (used by lookup() and offline tools)."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT profile FROM game_profiles WHERE game_name = ?", (game_name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    async def lookup(self, game_name: str) -> Optional[str]:
+        """The game's registered profile, or None if it has none."""
+        profile = self._profiles.get(game_name)
+        if profile is not None:
+            return profile
+        checked = self._unregistered.get(game_name)
+        if checked is not None and time.monotonic() - checked < UNREGISTERED_RECHECK:
+            return None
+        profile = await asyncio.get_running_loop().run_in_executor(None, self.read, game_name)
+        if profile is not None:
+            self._profiles[game_name] = profile
+            self._unregistered.pop(game_name, None)
+        else:
+            if len(self._unregistered) >= UNREGISTERED_LIMIT:
+                self._unregistered.clear()
+            self._unregistered[game_name] = time.monotonic()
+        return profile
+
+    async def profile(self, game_name: str) -> str:
+        return await self.lookup(game_name) or config.DEFAULT_PROFILE
+
+    async def register(self, game_name: str, profile: str):
+        """Record a new game's profile. Raises ValueError if it already has a different one."""
+        stored = await asyncio.get_running_loop().run_in_executor(None, self._register, game_name, profile)
+        self._profiles[game_name] = stored
+        self._unregistered.pop(game_name, None)
+        if stored != profile:
+            raise ValueError(f"{game_name} already uses durability profile {stored}")
+
+    def _register(self, game_name: str, profile: str) -> str:
+        with self._lock:
+            conn = self._connection()
+            try:
+                conn.execute(
+                    "INSERT INTO game_profiles (game_name, profile) VALUES (?, ?) ON CONFLICT(game_name) DO NOTHING",
+                    (game_name, profile),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return conn.execute("SELECT profile FROM game_profiles WHERE game_name = ?", (game_name,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -1,22 +1,158 @@
 import os
+import zlib
 
 class Config:
     DATA_DIR = "data"
+    # "per_game": one database file per game (DATA_DIR/{game}.db).
+    # "shared": every game's table lives in one of SHARD_COUNT files
+    # (DATA_DIR/shard_{n}.db, chosen by crc32 of the game name), so games share
+    # a WAL, a writer thread and, for batch endpoints, a single commit.
+    # Convert existing data with migrate_layout.py while the server is stopped.
+    STORAGE_LAYOUT = "per_game"
+    SHARD_COUNT = 1
     HTTP_PORT = 9097
+    # uvicorn worker processes. Claims stay atomic across workers because every
+    # write transaction starts with BEGIN IMMEDIATE (see connections.py).
+    WORKERS = 4
     # Performance tuning for SQLite
     SQLITE_TIMEOUT = 10.0  # Seconds
     SQLITE_PRAGMA = [
         "PRAGMA journal_mode=WAL;",  # Write-Ahead Logging for concurrency
         "PRAGMA synchronous=NORMAL;", # Revert to NORMAL for safety + speed (WAL handles it well)
         "PRAGMA busy_timeout=5000;", # Wait up to 5s if locked
-        "PRAGMA cache_size=-64000;", # 64MB cache
         "PRAGMA foreign_keys=ON;"
     ]
+    # Page cache per connection in KiB (applied as PRAGMA cache_size). Every open
+    # database has one writer and READER_THREADS reader connections, and at most
+    # MAX_OPEN_GAMES databases are open, so page cache memory stays below
+    # MAX_OPEN_GAMES * (1 + READER_THREADS) * SQLITE_CACHE_KB.
+    SQLITE_CACHE_KB = 8000
+    # Open game databases (database files, see STORAGE_LAYOUT) kept at once. Beyond this the least recently used idle
+    # one is checkpointed and closed; it is reopened on its next request.
+    MAX_OPEN_GAMES = 64
+
+    # Finished SQL strings kept by the statement cache (keyed by game and query shape),
+    # and prepared statements kept per sqlite3 connection
+    STATEMENT_CACHE_SIZE = 1024
+    CACHED_STATEMENTS = 256
+
+    # In-memory index of accounts seen in the last HOT_SET_WINDOW seconds.
+    # /query calls whose online_duration fits in the window are answered from
+    # memory and talk stamps are written through to SQLite. Only valid with
+    # WORKERS = 1, since other processes' claims would not be visible.
+    HOT_SET_ENABLED = False
+    HOT_SET_WINDOW = 600  # Seconds
+
+    # Every database file gets one writer thread fed by a bounded queue.
+    # Writers wait (without blocking the event loop) up to WRITE_QUEUE_TIMEOUT
+    # seconds when the queue is full.
+    WRITE_QUEUE_SIZE = 1000
+    WRITE_QUEUE_TIMEOUT = 5.0  # Seconds
+    # Reader threads per database file, each with its own read-only connection;
+    # SQLite reads never run on the event loop
+    READER_THREADS = 2
+
+    # Admission control per game (src/admission.py): at most GAME_MAX_CONCURRENCY
+    # requests of one game run at once and up to GAME_MAX_QUEUE more wait in
+    # FIFO order for at most ADMISSION_WAIT_TIMEOUT seconds. Anything beyond
+    # that is rejected with 429 so one flooded game cannot starve the others.
+    ADMISSION_ENABLED = True
+    GAME_MAX_CONCURRENCY = 8
+    GAME_MAX_QUEUE = 64
+    ADMISSION_WAIT_TIMEOUT = 2.0  # Seconds
+
+    # /insert, /update and /query parse bodies without pydantic and return
+    # pre-serialized JSON (src/fastpath.py, orjson when installed). Bodies that
+    # need type coercion or fail validation fall back to the pydantic models,
+    # so responses and error messages are unchanged.
+    FAST_PATH = True
+
+    # /query with "Accept: application/x-ndjson" streams one JSON row per line,
+    # fetched, stamped and sent STREAM_BATCH_SIZE rows at a time, so memory per
+    # request does not grow with cnt. Each batch passes admission control again.
+    STREAM_BATCH_SIZE = 500
+
+    # Request, stage and SQLite timings served at GET /metrics (Prometheus text format).
+    # Recording is per thread without locks. With WORKERS > 1 each worker writes
+    # its numbers to DATA_DIR/_metrics every METRICS_SYNC_INTERVAL seconds and a
+    # scrape adds up all workers (see metrics.WorkerSync).
+    METRICS_ENABLED = True
+    METRICS_SYNC_INTERVAL = 1.0  # Seconds
+
+    # Schema for newly created game tables: store online_time, created_at and
+    # last_talk_time1..6 as INTEGER epoch seconds instead of formatted text.
+    # Existing tables keep their schema until converted with migrate_epoch.py;
+    # the API renders both as 'YYYY-MM-DD HH:MM:SS'.
+    EPOCH_TIMESTAMPS = False
+
+    # Composite indexes for /query (see database.advised_indexes).
+    # Per-channel (last_talk_timeN, online_time) indexes are opt-in: every listed
+    # channel adds an index that each heartbeat has to maintain, and with ANALYZE
+    # statistics the planner preferred the online_time index in bench_indexes.py.
+    ADVISED_INDEXES = True
+    ADVISED_TALK_CHANNELS = ()
+
+    # Background storage maintenance (src/maintenance.py), run every
+    # MAINTENANCE_INTERVAL seconds on each open database's writer thread.
+    # A WAL above WAL_CHECKPOINT_BYTES gets a PASSIVE checkpoint, above
+    # WAL_TRUNCATE_BYTES a TRUNCATE one; PRAGMA optimize runs every
+    # OPTIMIZE_INTERVAL seconds. With INCREMENTAL_VACUUM, new databases use
+    # auto_vacuum=INCREMENTAL and up to VACUUM_PAGES free pages are released per run.
+    MAINTENANCE_ENABLED = True
+    MAINTENANCE_INTERVAL = 30.0  # Seconds
+    WAL_CHECKPOINT_BYTES = 16 * 1024 * 1024
+    WAL_TRUNCATE_BYTES = 64 * 1024 * 1024
+    OPTIMIZE_INTERVAL = 3600.0  # Seconds
+    INCREMENTAL_VACUUM = False
+    VACUUM_PAGES = 1000
+
+    # /clearTalkChannel records the reset time and returns at once; stamps older
+    # than it count as cleared. The stale stamps are then rewritten in the
+    # background, TALK_RESET_CHUNK ids per writer transaction.
+    TALK_RESET_CHUNK = 5000
+
+    # Durability profiles, chosen per game with {"profile": ...} at /createNewGame
+    # and kept in DATA_DIR/_catalog.db; games created without one use
+    # DEFAULT_PROFILE. "pragmas" run after SQLITE_PRAGMA. "write_behind"
+    # overrides WRITE_BEHIND_ENABLED for the game's /insert (None keeps it).
+    # "in_memory" games live in an in-memory SQLite database that is copied to
+    # DATA_DIR/{game}.db every SNAPSHOT_INTERVAL seconds and when it is closed,
+    # so a crash loses at most that interval; they require WORKERS = 1.
+    # Games with a profile other than DEFAULT_PROFILE always get their own
+    # database file, also with STORAGE_LAYOUT = "shared".
+    DURABILITY_PROFILES = {
+        # Disposable data such as lobby lists
+        "memory": {"pragmas": ["PRAGMA synchronous=OFF;"], "write_behind": False, "in_memory": True},
+        # The settings every game used before profiles existed
+        "fast": {"pragmas": ["PRAGMA synchronous=NORMAL;"], "write_behind": None},
+        # fsync on every commit, and every /insert is committed before it is acknowledged
+        "safe": {"pragmas": ["PRAGMA synchronous=FULL;"], "write_behind": False},
+    }
+    DEFAULT_PROFILE = "fast"
+    SNAPSHOT_INTERVAL = 30.0  # Seconds
+
+    # Rows deleted per transaction when deduplicating accounts during migration.
+    # Larger tables are upgraded by a background task (LogicService._ensure_upgraded).
+    MIGRATION_CHUNK_SIZE = 1000
+
+    # Write-behind batching for /insert (similar to the Go cache.Insert)
+    # Heartbeats are buffered per game and flushed as one transaction once
+    # WRITE_BEHIND_BATCH_SIZE accounts are pending or every
+    # WRITE_BEHIND_FLUSH_INTERVAL seconds. /query may lag by up to one interval.
+    # /update flushes the game first, but only in its own worker: with
+    # WORKERS > 1 a heartbeat buffered by another worker can still land after
+    # the update and overwrite b_zone, s_zone and rating.
+    WRITE_BEHIND_ENABLED = False
+    WRITE_BEHIND_BATCH_SIZE = 500
+    WRITE_BEHIND_FLUSH_INTERVAL = 1.0  # Seconds
     
-    def get_db_path(self, game_name: str) -> str:
+    def get_db_path(self, game_name: str, profile: str = None) -> str:
         # Ensure data directory exists
         if not os.path.exists(self.DATA_DIR):
             os.makedirs(self.DATA_DIR, exist_ok=True)
+        if self.STORAGE_LAYOUT == "shared" and profile in (None, self.DEFAULT_PROFILE):
+            shard = zlib.crc32(game_name.encode("utf-8")) % max(1, self.SHARD_COUNT)
+            return os.path.join(self.DATA_DIR, f"shard_{shard}.db")
         return os.path.join(self.DATA_DIR, f"{game_name}.db")
 
 config = Config()
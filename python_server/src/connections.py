@@ -0,0 +1,415 @@
+import asyncio
+import os
+import threading
+import logging
+import queue
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from .catalog import Catalog
+from .config import config
+from .database import connect
+from .metrics import SQLITE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class WriteQueueFull(RuntimeError):
+    pass
+
+# Rollback callbacks of the writer job running on the current thread (see on_rollback)
+_job = threading.local()
+
+def on_rollback(callback: Callable[[], None]):
+    """Call callback if the writer job calling this ends without committing its transaction.
+
+    For work that has to be undone outside SQLite, such as rows taken from an
+    in-memory buffer. Only valid inside a job submitted with transaction=True.
+    """
+    _job.rollbacks.append(callback)
+
+class DatabaseHandle:
+    """All connections to one database file.
+
+    Writes are funneled through a single writer thread that owns the only
+    read-write connection, so transactions never interleave and WAL readers
+    are never blocked by Python-level locks. Reads run on a small pool of
+    reader threads (Config.READER_THREADS), each with its own read-only
+    connection. Both return concurrent futures, so callers on the event
+    loop can await them without blocking it.
+
+    Every write transaction starts with BEGIN IMMEDIATE, which takes SQLite's
+    write lock up front. That makes read-then-write sequences (talk channel
+    claims) atomic across uvicorn worker processes, not just within one.
+
+    With an in-memory durability profile the connections share an in-memory
+    copy of the file. The writer loads it from the file before serving
+    anything and writes it back every SNAPSHOT_INTERVAL seconds (when it
+    changed) and on close.
+    """
+
+    def __init__(self, db_path: str, profile: Optional[str] = None, after: Optional[Future] = None):
+        self.db_path = db_path
+        self.profile = profile or config.DEFAULT_PROFILE
+        self.in_memory = config.DURABILITY_PROFILES.get(self.profile, {}).get("in_memory", False)
+        self.label = os.path.basename(db_path)
+        # Requests currently using this handle; only idle handles are evicted (guarded by ConnectionManager)
+        self.refs = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=config.WRITE_QUEUE_SIZE)
+        self._readers: Dict[int, sqlite3.Connection] = {}
+        self._readers_lock = threading.Lock()
+        # Readers of an in-memory database wait until the writer has loaded it
+        self._ready = threading.Event()
+        if not self.in_memory:
+            self._ready.set()
+        # Close of an earlier handle for the same file, which must finish before the writer opens it
+        self._after = after
+        self._failure: Optional[BaseException] = None
+        self._read_pool = ThreadPoolExecutor(
+            max_workers=max(1, config.READER_THREADS), thread_name_prefix=f"sqlite-reader:{db_path}"
+        )
+        self._writer = threading.Thread(target=self._run, name=f"sqlite-writer:{db_path}", daemon=True)
+        self._writer.start()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any], transaction: bool = True,
+               timeout: Optional[float] = None) -> Future:
+        """Queue fn(conn) to run on the writer thread.
+
+        With transaction=False fn runs in autocommit mode and manages its own transactions.
+        Waits up to `timeout` seconds (default WRITE_QUEUE_TIMEOUT) for room in the queue.
+        """
+        future: Future = Future()
+        try:
+            self._queue.put((fn, future, transaction, time.perf_counter()),
+                            timeout=config.WRITE_QUEUE_TIMEOUT if timeout is None else timeout)
+        except queue.Full:
+            raise WriteQueueFull(f"write queue is full for {self.db_path}")
+        return future
+
+    def read(self, fn: Callable[[sqlite3.Connection], Any]) -> Future:
+        """Run fn(conn) on a reader thread with that thread's read-only connection."""
+        return self._read_pool.submit(self._timed_read, fn)
+
+    def _timed_read(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            conn = self.reader()
+            if self._failure is not None:
+                raise self._failure
+            return fn(conn)
+        finally:
+            SQLITE_SECONDS.observe(time.perf_counter() - start, self.label, "read")
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def reader(self) -> sqlite3.Connection:
+        ident = threading.get_ident()
+        conn = self._readers.get(ident)
+        if conn is None:
+            self._ready.wait()
+            conn = connect(self.db_path, read_only=True, profile=self.profile)
+            with self._readers_lock:
+                self._readers[ident] = conn
+        return conn
+
+    def close(self):
+        """Close readers, then let the writer checkpoint the WAL into the database and exit."""
+        self._read_pool.shutdown(wait=True)
+        with self._readers_lock:
+            for conn in self._readers.values():
+                conn.close()
+            self._readers.clear()
+        self._queue.put(None)
+        self._writer.join()
+
+    @property
+    def failed(self) -> bool:
+        """Whether the writer could not open the database; it then fails every request."""
+        return self._failure is not None
+
+    def _run(self):
+        conn = None
+        failure = None
+        try:
+            if self._after is not None:
+                # An in-memory copy is only reloaded once the previous one is written back
+                self._after.result()
+                self._after = None
+            conn = connect(self.db_path, profile=self.profile)
+            # Transactions are managed explicitly so they can start with BEGIN IMMEDIATE
+            conn.isolation_level = None
+            if self.in_memory:
+                # Fail every request rather than serve (and later snapshot) an empty database
+                self._restore(conn)
+        except Exception as e:
+            # Keep draining the queue so every caller gets the error instead of waiting forever;
+            # ConnectionManager replaces the handle on the next request
+            logger.error(f"Opening {self.db_path} failed: {e}")
+            failure = self._failure = e
+        self._ready.set()
+        # Any job since the last snapshot; total_changes would miss schema changes
+        dirty = False
+        next_snapshot = time.monotonic() + config.SNAPSHOT_INTERVAL
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=config.SNAPSHOT_INTERVAL if self.in_memory else None)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if self.in_memory and failure is None and time.monotonic() >= next_snapshot:
+                    if dirty:
+                        try:
+                            self._snapshot(conn)
+                            dirty = False
+                        except (sqlite3.Error, OSError) as e:
+                            logger.warning(f"Snapshot failed for {self.db_path}: {e}")
+                    next_snapshot = time.monotonic() + config.SNAPSHOT_INTERVAL
+                if not item:
+                    continue
+                fn, future, transaction, queued_at = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if failure is not None:
+                    future.set_exception(failure)
+                    continue
+                dirty = True
+                rollbacks = _job.rollbacks = []
+                start = time.perf_counter()
+                SQLITE_SECONDS.observe(start - queued_at, self.label, "queue")
+                try:
+                    if transaction:
+                        conn.execute("BEGIN IMMEDIATE")
+                    result = fn(conn)
+                    executed = time.perf_counter()
+                    SQLITE_SECONDS.observe(executed - start, self.label, "execute")
+                    if conn.in_transaction:
+                        conn.execute("COMMIT")
+                        SQLITE_SECONDS.observe(time.perf_counter() - executed, self.label, "commit")
+                except BaseException as e:
+                    if conn.in_transaction:
+                        try:
+                            conn.execute("ROLLBACK")
+                        except sqlite3.Error as rollback_error:
+                            logger.error(f"Rollback failed for {self.db_path}: {rollback_error}")
+                    for callback in rollbacks:
+                        try:
+                            callback()
+                        except Exception as callback_error:
+                            logger.error(f"Rollback callback failed for {self.db_path}: {callback_error}")
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            if conn is not None:
+                try:
+                    if not self.in_memory:
+                        # Leave no WAL behind, so a closed game costs nothing but its file
+                        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+                    elif failure is None and dirty:
+                        self._snapshot(conn)
+                except (sqlite3.Error, OSError) as e:
+                    logger.warning(f"Checkpoint or snapshot on close failed for {self.db_path}: {e}")
+                conn.close()
+
+    def _restore(self, conn: sqlite3.Connection):
+        """Load the file into the in-memory database. Runs on the writer thread before any request."""
+        if not os.path.exists(self.db_path):
+            return
+        disk = sqlite3.connect(self.db_path, timeout=config.SQLITE_TIMEOUT)
+        try:
+            # Fold a WAL left by a disk-backed handle into the file, so snapshots can replace it whole
+            disk.execute("PRAGMA journal_mode=DELETE;")
+            disk.backup(conn)
+        finally:
+            disk.close()
+
+    def _snapshot(self, conn: sqlite3.Connection):
+        """Copy the in-memory database to its file: written beside it, then renamed over it."""
+        start = time.perf_counter()
+        tmp_path = self.db_path + ".snapshot"
+        target = sqlite3.connect(tmp_path)
+        try:
+            conn.backup(target)
+        finally:
+            target.close()
+        os.replace(tmp_path, self.db_path)
+        SQLITE_SECONDS.observe(time.perf_counter() - start, self.label, "snapshot")
+
+class ConnectionManager:
+    """Runs reads and writes for each database file from the event loop.
+
+    At most Config.MAX_OPEN_GAMES handles stay open. Handles are kept in LRU
+    order; when the limit is exceeded the least recently used handle that no
+    request is using is closed on a background thread and reopened on its
+    next request. Busy handles are never evicted, so the limit can be
+    exceeded briefly while they finish.
+
+    Each game's file and durability profile come from the catalog.
+    """
+
+    def __init__(self):
+        self._handles: "OrderedDict[str, DatabaseHandle]" = OrderedDict()
+        # Handles replaced while in use, closed by their last _release
+        self._retired: Set[DatabaseHandle] = set()
+        # Closes still running per file; a handle reopening the file waits for them
+        self._closing: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.catalog = Catalog()
+        self._closer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-closer")
+        self.opened = 0
+        self.evictions = 0
+
+    async def locate(self, game_name: str) -> Tuple[str, str]:
+        """The game's database file and durability profile."""
+        profile = await self.catalog.profile(game_name)
+        return config.get_db_path(game_name, profile), profile
+
+    def _acquire(self, db_path: str, profile: Optional[str] = None) -> DatabaseHandle:
+        """The open handle for db_path, opened with `profile` if needed (None: whatever is open, else the default)."""
+        with self._lock:
+            handle = self._handles.get(db_path)
+            # Opened before another worker registered the game's profile, or could not be
+            # opened at all (its requests fail with the error; this one tries again)
+            if handle is not None and (handle.failed or profile is not None and handle.profile != profile):
+                del self._handles[db_path]
+                if handle.refs:
+                    self._retired.add(handle)
+                else:
+                    self._close_locked([handle])
+                handle = None
+            if handle is None:
+                closing = self._closing.pop(db_path, None)
+                if closing is not None and closing.done():
+                    closing = None
+                handle = self._handles[db_path] = DatabaseHandle(db_path, profile, after=closing)
+                self.opened += 1
+            else:
+                self._handles.move_to_end(db_path)
+            handle.refs += 1
+            self._close_locked(self._evict_locked())
+        return handle
+
+    def _acquire_open(self, db_path: str) -> Optional[DatabaseHandle]:
+        """The handle for db_path if it is open, without reopening it or touching its LRU position."""
+        with self._lock:
+            handle = self._handles.get(db_path)
+            if handle is not None:
+                handle.refs += 1
+            return handle
+
+    def _release(self, handle: DatabaseHandle):
+        with self._lock:
+            handle.refs -= 1
+            self._close_locked(self._evict_locked())
+            if handle.refs == 0 and handle in self._retired:
+                self._retired.discard(handle)
+                self._close_locked([handle])
+
+    def _evict_locked(self) -> List[DatabaseHandle]:
+        """Pop idle handles, oldest first, until the limit holds. Caller holds self._lock."""
+        victims = []
+        excess = len(self._handles) - max(1, config.MAX_OPEN_GAMES)
+        if excess <= 0:
+            return victims
+        for db_path, handle in list(self._handles.items()):
+            if handle.refs == 0:
+                del self._handles[db_path]
+                victims.append(handle)
+                if len(victims) >= excess:
+                    break
+        self.evictions += len(victims)
+        return victims
+
+    def _close_locked(self, victims: List[DatabaseHandle]):
+        """Close handles on the closer thread. Caller holds self._lock."""
+        # Closing joins threads and checkpoints the WAL; keep it off the caller (the event loop)
+        for handle in victims:
+            logger.debug(f"Closing idle database {handle.db_path}")
+            self._closing[handle.db_path] = self._closer.submit(handle.close)
+
+    def queue_depths(self) -> Dict[str, int]:
+        with self._lock:
+            return {db_path: handle.queue_depth() for db_path, handle in self._handles.items()}
+
+    def open_paths(self) -> List[str]:
+        with self._lock:
+            return list(self._handles.keys())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": len(self._handles),
+                "busy": sum(1 for handle in self._handles.values() if handle.refs),
+                "capacity": config.MAX_OPEN_GAMES,
+                "opened": self.opened,
+                "evictions": self.evictions,
+                "profiles": {
+                    profile: sum(1 for handle in self._handles.values() if handle.profile == profile)
+                    for profile in {handle.profile for handle in self._handles.values()}
+                },
+            }
+
+    async def run_read(self, game_name: str, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Await fn(conn) on one of the game's reader threads."""
+        handle = self._acquire(*await self.locate(game_name))
+        try:
+            return await asyncio.wrap_future(handle.read(fn))
+        finally:
+            self._release(handle)
+
+    async def run_write(self, game_name: str, fn: Callable[[sqlite3.Connection], Any], transaction: bool = True) -> Any:
+        """Await fn(conn) on the game's writer thread.
+
+        A full write queue is retried until WRITE_QUEUE_TIMEOUT without blocking the event loop.
+        """
+        db_path, profile = await self.locate(game_name)
+        return await self.run_write_path(db_path, fn, transaction, profile)
+
+    async def run_write_path(self, db_path: str, fn: Callable[[sqlite3.Connection], Any], transaction: bool = True,
+                             profile: Optional[str] = None) -> Any:
+        return await self._run_write_handle(self._acquire(db_path, profile), fn, transaction)
+
+    async def run_write_open(self, db_path: str, fn: Callable[[sqlite3.Connection], Any], transaction: bool = True) -> Any:
+        """run_write_path for a database that is already open; returns None without running fn if it is not.
+
+        For background work on open_paths(): a database evicted in the meantime is
+        left closed instead of being reopened (possibly with the wrong profile).
+        """
+        handle = self._acquire_open(db_path)
+        if handle is None:
+            return None
+        return await self._run_write_handle(handle, fn, transaction)
+
+    async def _run_write_handle(self, handle: DatabaseHandle, fn: Callable[[sqlite3.Connection], Any],
+                                transaction: bool) -> Any:
+        """Submit fn to an acquired handle's writer and await it; releases the handle."""
+        try:
+            deadline = time.monotonic() + config.WRITE_QUEUE_TIMEOUT
+            while True:
+                try:
+                    future = handle.submit(fn, transaction, timeout=0)
+                    break
+                except WriteQueueFull:
+                    if time.monotonic() >= deadline:
+                        raise
+                    await asyncio.sleep(0.01)
+            return await asyncio.wrap_future(future)
+        finally:
+            self._release(handle)
+
+    def close_all(self):
+        with self._lock:
+            handles = list(self._handles.values()) + list(self._retired)
+            self._handles.clear()
+            self._retired.clear()
+        for handle in handles:
+            handle.close()
+        # Wait for evicted handles that are still closing
+        self._closer.shutdown(wait=True)
+        self._closing.clear()
+        self._closer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-closer")
+        self.catalog.close()
@@ -1,71 +1,297 @@
 import sqlite3
 import logging
 import os
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import quote
 from .config import config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_connection(game_name: str):
-    """Create a new database connection for a specific game."""
-    db_path = config.get_db_path(game_name)
+def memory_uri(db_path: str) -> str:
+    """URI of the in-memory database standing in for db_path.
+
+    memdb names starting with "/" are shared by every connection in the process.
+    """
+    return "file:/" + quote(os.path.abspath(db_path).replace(os.sep, "/").lstrip("/")) + "?vfs=memdb"
+
+def connect(db_path: str, read_only: bool = False, profile: Optional[str] = None) -> sqlite3.Connection:
+    """Open a connection to a database file with the configured pragmas and those of its durability profile.
+
+    For in-memory profiles this connects to the process-wide in-memory copy (see memory_uri).
+    """
+    settings = config.DURABILITY_PROFILES.get(profile or config.DEFAULT_PROFILE, {})
+    in_memory = settings.get("in_memory", False)
     # check_same_thread=False allows sharing connection across threads, 
-    # BUT we must ensure serialized access (which we do via LockList).
-    conn = sqlite3.connect(db_path, timeout=config.SQLITE_TIMEOUT, check_same_thread=False)
+    # BUT we must ensure serialized access (the writer thread or a per-thread reader).
+    conn = sqlite3.connect(
+        memory_uri(db_path) if in_memory else db_path,
+        timeout=config.SQLITE_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=config.CACHED_STATEMENTS,
+        uri=in_memory,
+    )
     conn.row_factory = sqlite3.Row  # Access columns by name
     
-    # Apply performance pragmas
-    for pragma in config.SQLITE_PRAGMA:
+    if config.INCREMENTAL_VACUUM:
+        # Only takes effect on a brand-new file, and must come before journal_mode=WAL initializes it
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    # Apply performance pragmas (journal_mode=WAL stays "memory" for in-memory databases)
+    for pragma in config.SQLITE_PRAGMA + settings.get("pragmas", []):
         conn.execute(pragma)
+    conn.execute(f"PRAGMA cache_size=-{int(config.SQLITE_CACHE_KB)};")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON;")
     
     return conn
 
+def get_connection(game_name: str):
+    """Create a new database connection for a specific game."""
+    return connect(config.get_db_path(game_name))
+
 def init_db():
     """Initialize the database directory."""
     if not os.path.exists(config.DATA_DIR):
         os.makedirs(config.DATA_DIR, exist_ok=True)
     logger.info(f"Database directory initialized at {config.DATA_DIR}")
 
-def auto_migrate(game_name: str):
-    """Create the game table if it doesn't exist."""
-    
-    table_sql = f"""
-    CREATE TABLE IF NOT EXISTS "{game_name}" (
+def create_table_sql(game_name: str, epoch: bool = False, table_name: str = None) -> str:
+    """CREATE TABLE statement for a game table.
+
+    With epoch=True (schema used when Config.EPOCH_TIMESTAMPS is on) the time
+    columns are INTEGER seconds since the epoch and a talk time of 0 means
+    "never talked", instead of the '2000-01-01 00:00:00' text sentinel.
+    """
+    table_name = table_name or game_name
+    if epoch:
+        time_type, created_default, talk_default = "INTEGER", "(CAST(strftime('%s', 'now') AS INTEGER))", "0"
+    else:
+        time_type, created_default, talk_default = "TEXT", "CURRENT_TIMESTAMP", "'2000-01-01 00:00:00'"
+    talk_columns = ",\n".join(
+        f"        last_talk_time{channel} {time_type} DEFAULT {talk_default}" for channel in range(1, 7)
+    )
+    return f"""
+    CREATE TABLE IF NOT EXISTS "{table_name}" (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        online_time TEXT,
+        created_at {time_type} NOT NULL DEFAULT {created_default},
+        online_time {time_type},
         game_name TEXT,
         account TEXT,
         b_zone TEXT,
         s_zone TEXT,
         rating INTEGER,
-        last_talk_time1 TEXT DEFAULT '2000-01-01 00:00:00',
-        last_talk_time2 TEXT DEFAULT '2000-01-01 00:00:00',
-        last_talk_time3 TEXT DEFAULT '2000-01-01 00:00:00',
-        last_talk_time4 TEXT DEFAULT '2000-01-01 00:00:00',
-        last_talk_time5 TEXT DEFAULT '2000-01-01 00:00:00',
-        last_talk_time6 TEXT DEFAULT '2000-01-01 00:00:00'
+{talk_columns}
     );
     """
-    
+
+# Latest talk channel reset per game (see LogicService.clear_talk_time). reset_at has no
+# declared type so it keeps the representation of the game's time columns (text or epoch).
+TALK_RESETS_SQL = """
+    CREATE TABLE IF NOT EXISTS _talk_resets (
+        game_name TEXT NOT NULL,
+        channel INTEGER NOT NULL,
+        reset_at,
+        PRIMARY KEY (game_name, channel)
+    )
+"""
+
+def is_epoch_table(conn, game_name: str) -> Optional[bool]:
+    """True if the game table stores its time columns as INTEGER epoch seconds, None if it doesn't exist."""
+    for column in conn.execute(f'PRAGMA table_info("{game_name}")'):
+        if column[1] == "online_time":
+            return column[2].upper() == "INTEGER"
+    return None
+
+def base_indexes(game_name: str) -> List[str]:
+    """Indexes every game table gets at creation; upgrade_schema adds the rest."""
     indices_sql = [
-        f'CREATE INDEX IF NOT EXISTS "idx_{game_name}_account" ON "{game_name}" (account);',
-        f'CREATE INDEX IF NOT EXISTS "idx_{game_name}_zone" ON "{game_name}" (b_zone, s_zone);',
         f'CREATE INDEX IF NOT EXISTS "idx_{game_name}_online_time" ON "{game_name}" (online_time);'
     ]
+    if not config.ADVISED_INDEXES:
+        # Otherwise covered by the (b_zone, s_zone, online_time) advised index
+        indices_sql.append(f'CREATE INDEX IF NOT EXISTS "idx_{game_name}_zone" ON "{game_name}" (b_zone, s_zone);')
+    return indices_sql
+
+def auto_migrate(game_name: str, conn: Optional[sqlite3.Connection] = None, upgrade: bool = True):
+    """Create the game table if it doesn't exist, on conn (left open) or a fresh connection.
+
+    With upgrade=False an existing table is left for the caller to upgrade.
+    """
+    
+    table_sql = create_table_sql(game_name, epoch=config.EPOCH_TIMESTAMPS)
+    
+    indices_sql = base_indexes(game_name)
     
     # Use a fresh connection for migration (rare operation)
-    conn = get_connection(game_name)
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection(game_name)
     try:
         cursor = conn.cursor()
         cursor.execute(table_sql)
         for idx_sql in indices_sql:
             cursor.execute(idx_sql)
         conn.commit()
+        if upgrade:
+            upgrade_schema(conn, game_name)
     except Exception as e:
         conn.rollback()
         logger.error(f"Migration failed for {game_name}: {e}")
         raise e
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
+
+def _has_index(conn, index_name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,)
+    ).fetchone()
+    return row is not None
+
+def advised_indexes(game_name: str) -> List[Tuple[str, str]]:
+    """Indexes for the hot /query shapes as (index name, CREATE statement) pairs.
+
+    (b_zone, s_zone, online_time) serves zone filters with an online window,
+    and (last_talk_timeN, online_time) lets a talk channel claim range-scan
+    the stale stamps and check the online window from the index alone.
+    """
+    indexes = [(
+        f"idx_{game_name}_zone_online",
+        f'CREATE INDEX IF NOT EXISTS "idx_{game_name}_zone_online" ON "{game_name}" (b_zone, s_zone, online_time);',
+    )]
+    for channel in config.ADVISED_TALK_CHANNELS:
+        indexes.append((
+            f"idx_{game_name}_talk{channel}",
+            f'CREATE INDEX IF NOT EXISTS "idx_{game_name}_talk{channel}" '
+            f'ON "{game_name}" (last_talk_time{channel}, online_time);',
+        ))
+    return indexes
+
+def upgrade_schema(conn, game_name: str):
+    """Bring an existing game table up to date. No-op if the table is missing or already current.
+
+    Runs every step at once; the server spreads large tables over several writer jobs instead
+    (see upgrade_steps and LogicService._ensure_upgraded).
+    """
+    run_steps(conn, upgrade_steps(conn, game_name) or [])
+
+def upgrade_steps(conn, game_name: str) -> Optional[List[Callable[[sqlite3.Connection], bool]]]:
+    """Create the cheap missing pieces and return the remaining upgrade work as steps.
+
+    Each step runs its own short transactions and returns True while it has more to do,
+    so callers can let other writes in between calls. None if the table doesn't exist.
+    """
+    table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (game_name,)
+    ).fetchone()
+    if table is None:
+        return None
+    conn.execute(TALK_RESETS_SQL)
+    steps = []
+    if not has_unique_account(conn, game_name):
+        steps += _unique_account_steps(game_name)
+    if config.ADVISED_INDEXES:
+        steps += _advised_index_steps(conn, game_name)
+    return steps
+
+def run_steps(conn, steps: List[Callable[[sqlite3.Connection], bool]]):
+    for step in steps:
+        while step(conn):
+            pass
+
+def is_small_table(conn, game_name: str) -> bool:
+    """At most MIGRATION_CHUNK_SIZE rows, so upgrading it at once is as quick as one chunk."""
+    row = conn.execute(
+        f'SELECT 1 FROM "{game_name}" LIMIT 1 OFFSET ?', (config.MIGRATION_CHUNK_SIZE,)
+    ).fetchone()
+    return row is None
+
+def has_unique_account(conn, game_name: str) -> bool:
+    """Whether the table has the UNIQUE(account) index that ON CONFLICT(account) relies on."""
+    return _has_index(conn, f"uk_{game_name}_account")
+
+def _advised_index_steps(conn, game_name: str) -> List[Callable[[sqlite3.Connection], bool]]:
+    missing = [sql for name, sql in advised_indexes(game_name) if not _has_index(conn, name)]
+    if not missing:
+        return []
+
+    def create(sql: str) -> Callable[[sqlite3.Connection], bool]:
+        def step(conn) -> bool:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(sql)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return False
+        return step
+
+    def finish(conn) -> bool:
+        try:
+            # (b_zone, s_zone) is a prefix of the zone/online index
+            conn.execute(f'DROP INDEX IF EXISTS "idx_{game_name}_zone";')
+            # Fresh statistics so the planner can choose between the zone and talk indexes
+            conn.execute(f'ANALYZE "{game_name}";')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Created {len(missing)} advised indexes on {game_name}")
+        return False
+
+    # One index per step so other writers get a turn in between
+    return [create(sql) for sql in missing] + [finish]
+
+def _unique_account_steps(game_name: str) -> List[Callable[[sqlite3.Connection], bool]]:
+    """Tables created before UPSERT support may hold several rows per account.
+
+    Those are deduplicated (keeping the newest row) in small committed chunks
+    so other writes are only blocked briefly, then the UNIQUE(account) index
+    that ON CONFLICT(account) relies on is created. Until then writers must not
+    add duplicates (see LogicService._apply_inserts).
+    """
+    unique_index = f"uk_{game_name}_account"
+    dedup_sql = f'''
+        DELETE FROM "{game_name}" WHERE id IN (
+            SELECT id FROM "{game_name}" AS t
+            WHERE EXISTS (SELECT 1 FROM "{game_name}" AS n WHERE n.account = t.account AND n.id > t.id)
+            LIMIT ?
+        )
+    '''
+
+    def index_account(conn) -> bool:
+        # The dedup probe needs an account index to avoid a quadratic scan
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{game_name}_account" ON "{game_name}" (account);')
+        conn.commit()
+        return False
+
+    def dedup_chunk(conn) -> bool:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(dedup_sql, (config.MIGRATION_CHUNK_SIZE,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if cursor.rowcount > 0:
+            logger.info(f"Removed {cursor.rowcount} duplicate accounts from {game_name}")
+        return cursor.rowcount >= config.MIGRATION_CHUNK_SIZE
+
+    def create_unique(conn) -> bool:
+        try:
+            # Final pass and index creation share one transaction so no duplicate can slip in
+            # between, even from another worker process
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(dedup_sql, (-1,))
+            conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{unique_index}" ON "{game_name}" (account);')
+            # The plain account index is covered by the unique one
+            conn.execute(f'DROP INDEX IF EXISTS "idx_{game_name}_account";')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return False
+
+    return [index_account, dedup_chunk, create_unique]
@@ -0,0 +1,109 @@
+import json
+import re
+from typing import Optional, Type, Union
+from fastapi import Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from .models import BaseInfo, QueryReq
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the standard library
+    orjson = None
+
+if orjson is not None:
+    loads = orjson.loads
+    dumps = orjson.dumps
+else:
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        # Same bytes as FastAPI's JSONResponse
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+GAME_NAME_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9_]*$')
+# Game names that already passed GAME_NAME_RE; cleared when it grows past the limit
+KNOWN_NAMES_LIMIT = 10000
+_known_names: set = set()
+_MISSING = object()
+
+class FastBaseInfo:
+    """BaseInfo without pydantic: the same attributes, read from the same JSON keys (the aliases)."""
+    __slots__ = ("ID", "GameName", "Account", "BZone", "SZone", "Rating")
+
+    MODEL: Type[BaseInfo] = BaseInfo
+    # (attribute, JSON key, type, default); a default of None marks an Optional field
+    FIELDS = (
+        ("ID", "ID", int, None),
+        ("Account", "account", str, None),
+        ("BZone", "b_zone", str, None),
+        ("SZone", "s_zone", str, None),
+        ("Rating", "rating", int, None),
+    )
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """The struct, or None if any value needs pydantic's coercion rules or error reporting."""
+        name = data.get("game_name")
+        if type(name) is not str or not _valid_name(name):
+            return None
+        obj = cls.__new__(cls)
+        obj.GameName = name
+        for attr, key, kind, default in cls.FIELDS:
+            value = data.get(key, _MISSING)
+            if value is _MISSING:
+                value = default
+            elif type(value) is not kind and not (value is None and default is None):
+                return None
+            setattr(obj, attr, value)
+        return obj
+
+class FastQueryReq(FastBaseInfo):
+    __slots__ = ("OnlineDuration", "TalkChannel", "Cnt")
+
+    MODEL = QueryReq
+    FIELDS = FastBaseInfo.FIELDS + (
+        ("OnlineDuration", "online_duration", int, 0),
+        ("TalkChannel", "talk_channel", int, 0),
+        ("Cnt", "cnt", int, 0),
+    )
+
+def _valid_name(name: str) -> bool:
+    if name in _known_names:
+        return True
+    if not GAME_NAME_RE.match(name):
+        return False
+    if len(_known_names) >= KNOWN_NAMES_LIMIT:
+        _known_names.clear()
+    _known_names.add(name)
+    return True
+
+def parse(body: bytes, cls: Type[FastBaseInfo]) -> Union[FastBaseInfo, BaseInfo]:
+    """Decode a request body into cls.
+
+    Bodies the exact-type checks do not accept go through cls.MODEL, so
+    coercions (e.g. "5" for an int) and validation errors are the same as
+    on the pydantic routes.
+    """
+    try:
+        data = loads(body)
+    except ValueError as e:
+        raise RequestValidationError([{
+            "type": "json_invalid", "loc": ("body", 0), "msg": "JSON decode error", "input": {}, "ctx": {"error": str(e)},
+        }])
+    if type(data) is dict:
+        obj = cls.from_dict(data)
+        if obj is not None:
+            return obj
+    try:
+        # from_attributes and include_url=False as in FastAPI's own body validation
+        return cls.MODEL.model_validate(data, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [dict(error, loc=("body",) + tuple(error["loc"])) for error in e.errors(include_url=False)]
+        )
+
+def json_response(payload: Optional[Union[dict, bytes]]) -> Response:
+    """Raw JSON response; bytes are sent as they are."""
+    content = payload if isinstance(payload, bytes) else dumps(payload)
+    return Response(content, media_type="application/json")
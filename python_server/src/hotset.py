@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+class HotEntry:
+    """One recently online account: the API row plus numeric times for filtering."""
+    __slots__ = ("row", "online", "talk")
+
+    def __init__(self, row: dict, online: float, talk: List[float]):
+        self.row = row
+        self.online = online
+        self.talk = talk  # Index 1..6, epoch seconds of the last claim per channel
+
+class GameHotSet:
+    """Recently online accounts of one game.
+
+    Accounts are kept in `order` (oldest online_time first) and in one
+    ordered bucket per (b_zone, s_zone), so a zone query only walks its own
+    bucket from the newest end and stops at the first entry outside the
+    online window. Entries older than `window` seconds are evicted.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self.lock = threading.Lock()
+        # Last reset per talk channel (table representation); claims never stamp below it
+        self.talk_floor: List = [None] * 7
+        self._entries: Dict[str, HotEntry] = {}
+        self._order: "OrderedDict[str, None]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, str], "OrderedDict[str, None]"] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bucket(self, row: dict) -> "OrderedDict[str, None]":
+        key = (row.get("b_zone"), row.get("s_zone"))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = OrderedDict()
+        return bucket
+
+    def _unlink(self, account: str, entry: HotEntry):
+        self._order.pop(account, None)
+        key = (entry.row.get("b_zone"), entry.row.get("s_zone"))
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.pop(account, None)
+            if not bucket:
+                del self._buckets[key]
+
+    def add(self, entry: HotEntry):
+        """Insert or replace an entry. Caller holds self.lock."""
+        account = entry.row.get("account")
+        old = self._entries.get(account)
+        if old is not None:
+            self._unlink(account, old)
+        self._entries[account] = entry
+        self._order[account] = None
+        self._bucket(entry.row)[account] = None
+
+    def refresh(self, account: str, b_zone, s_zone, rating, online: float, online_str: str) -> bool:
+        """Apply a heartbeat to a known account. Caller holds self.lock. False if the account is not cached."""
+        entry = self._entries.get(account)
+        if entry is None:
+            return False
+        self._unlink(account, entry)
+        entry.row.update(b_zone=b_zone, s_zone=s_zone, rating=rating)
+        if online >= entry.online:
+            entry.online = online
+            entry.row["online_time"] = online_str
+        self._order[account] = None
+        self._bucket(entry.row)[account] = None
+        return True
+
+    def stamp(self, account: str, channel: int, value: float, value_str: str):
+        """Record a claim on a talk channel made outside the hot set. Caller holds self.lock."""
+        entry = self._entries.get(account)
+        if entry is not None:
+            entry.talk[channel] = value
+            entry.row[f"last_talk_time{channel}"] = value_str
+
+    def evict(self, now: Optional[float] = None):
+        """Drop entries that left the window. Caller holds self.lock."""
+        horizon = (now or time.time()) - self.window
+        while self._order:
+            account = next(iter(self._order))
+            entry = self._entries[account]
+            if entry.online > horizon:
+                break
+            self._unlink(account, entry)
+            del self._entries[account]
+
+    def select(self, account, b_zone, s_zone, rating, online_cutoff: float,
+               channel: int, talk_cutoff: float, cnt: int) -> List[HotEntry]:
+        """Entries matching a /query, newest first. Caller holds self.lock."""
+        if account:
+            entry = self._entries.get(account)
+            candidates = [account] if entry is not None else []
+        elif b_zone and s_zone:
+            candidates = reversed(self._buckets.get((b_zone, s_zone), {}))
+        else:
+            candidates = reversed(self._order)
+
+        result = []
+        for name in candidates:
+            entry = self._entries[name]
+            if entry.online <= online_cutoff:
+                if account:
+                    continue
+                break  # Candidates are ordered by online_time, the rest are older still
+            row = entry.row
+            if b_zone and row.get("b_zone") != b_zone:
+                continue
+            if s_zone and row.get("s_zone") != s_zone:
+                continue
+            if rating and row.get("rating") != rating:
+                continue
+            if channel and entry.talk[channel] >= talk_cutoff:
+                continue
+            result.append(entry)
+            if len(result) >= cnt:
+                break
+        return result
+
+    def reset_talk(self, channel: int, value: float, value_str: str, reset_at):
+        with self.lock:
+            self.talk_floor[channel] = reset_at
+            field = f"last_talk_time{channel}"
+            for entry in self._entries.values():
+                entry.talk[channel] = value
+                entry.row[field] = value_str
+
+class HotSet:
+    """Per-game GameHotSets; a game is loaded from SQLite the first time it is queried."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._games: Dict[str, GameHotSet] = {}
+        self._lock = threading.Lock()
+
+    def get(self, game_name: str) -> Optional[GameHotSet]:
+        return self._games.get(game_name)
+
+    def install(self, game_name: str, hot: GameHotSet) -> GameHotSet:
+        with self._lock:
+            return self._games.setdefault(game_name, hot)
+
+    def discard(self, game_name: str):
+        with self._lock:
+            self._games.pop(game_name, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {game_name: len(hot) for game_name, hot in self._games.items()}
@@ -1,192 +1,835 @@
-import threading
+import asyncio
 import logging
 import sqlite3
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, List, Optional, Tuple
 from .models import BaseInfo, QueryReq
-from .database import get_connection, auto_migrate
+from .database import auto_migrate, has_unique_account, is_epoch_table, is_small_table, run_steps, upgrade_steps
+from .config import config
+from .connections import ConnectionManager, on_rollback
+from .write_behind import WriteBehindBuffer, PendingRow
+from .maintenance import MaintenanceScheduler
+from .metrics import LOCK_WAIT_SECONDS, ROWS_RETURNED
+from .hotset import HotSet, GameHotSet, HotEntry
+from .statements import (
+    StatementCache, PRED_ACCOUNT, PRED_B_ZONE, PRED_S_ZONE, PRED_RATING, PRED_ONLINE, PRED_TALK,
+)
 
 logger = logging.getLogger(__name__)
 
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Talk time meaning "never talked": text sentinel, or 0 in epoch tables
+TALK_RESET_STR = "2000-01-01 00:00:00"
+TIME_FIELDS = ("created_at", "online_time") + tuple(f"last_talk_time{channel}" for channel in range(1, 7))
+
+# UPDATE ... RETURNING needs SQLite 3.35+; older builds fall back to SELECT then UPDATE
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
 class LockList:
+    # Per-game asyncio locks; only touched from the event loop, so the dict needs no lock of its own
     def __init__(self):
-        self._locks = {}
-        self._global_lock = threading.Lock()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def get_lock(self, game_name: str) -> asyncio.Lock:
+        lock = self._locks.get(game_name)
+        if lock is None:
+            lock = self._locks[game_name] = asyncio.Lock()
+        return lock
 
-    def get_lock(self, game_name: str) -> threading.Lock:
-        with self._global_lock:
-            if game_name not in self._locks:
-                self._locks[game_name] = threading.Lock()
-            return self._locks[game_name]
+    @asynccontextmanager
+    async def hold(self, game_name: str):
+        """Hold the game's lock, recording how long it took to get it."""
+        lock = self.get_lock(game_name)
+        start = time.perf_counter()
+        async with lock:
+            LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, game_name)
+            yield
 
 class LogicService:
+    """Game logic for the API, async end to end.
+
+    SQLite work runs on each database file's reader and writer threads
+    (see connections.py) and is awaited, so a slow game only delays its own
+    requests instead of stalling the event loop for every game in the worker.
+    """
+
     def __init__(self):
+        # Only table creation and hot set loading are serialized per game; reads and writes go through self.connections
         self.locker = LockList()
-        self._conns: Dict[str, sqlite3.Connection] = {}
-        self._conn_lock = threading.Lock()
-
-    def _get_connection_pooled(self, game_name: str) -> sqlite3.Connection:
-        # Check if we already have a connection for this game
-        # Note: Connections are not thread-safe by default, but we use them inside the game lock
-        # so only one thread accesses a game's connection at a time.
-        # However, checking self._conns needs protection.
-        
-        # Optimization: We can use double-checked locking or just lock for the dict access.
-        # But wait, self._conns access itself needs a lock.
-        # Once we have the connection, we use it under the Game Lock.
-        
-        conn = None
-        with self._conn_lock:
-            conn = self._conns.get(game_name)
-            if conn is None:
-                conn = get_connection(game_name)
-                self._conns[game_name] = conn
-        return conn
+        self.connections = ConnectionManager()
+        self.statements = StatementCache(config.STATEMENT_CACHE_SIZE)
+        self.maintenance = MaintenanceScheduler(self.connections)
+        self._upgraded = set()
+        # Games whose table has no UNIQUE(account) yet; _apply_inserts cannot use ON CONFLICT for them
+        self._legacy_tables = set()
+        self._upgrades: Dict[str, asyncio.Task] = {}
+        self._known_tables = set()
+        self._epoch_tables = {}
+        self._talk_cleanups: Dict[Tuple[str, int], asyncio.Task] = {}
+        self.hot_set = HotSet(config.HOT_SET_WINDOW)
+        self._hot_enabled = config.HOT_SET_ENABLED
+        if self._hot_enabled and config.WORKERS > 1:
+            # Claims stamped in another process would be invisible to this one's memory
+            logger.warning("HOT_SET_ENABLED requires WORKERS = 1; hot set disabled")
+            self._hot_enabled = False
+        self.write_buffer = WriteBehindBuffer(
+            self.flush_pending,
+            config.WRITE_BEHIND_BATCH_SIZE,
+            config.WRITE_BEHIND_FLUSH_INTERVAL,
+        )
+
+    def start(self):
+        """Start background work. Called from the running event loop."""
+        if config.WRITE_BEHIND_ENABLED or any(
+            settings.get("write_behind") for settings in config.DURABILITY_PROFILES.values()
+        ):
+            self.write_buffer.start()
+        if config.MAINTENANCE_ENABLED:
+            self.maintenance.start()
+
+    async def stop(self):
+        await self.maintenance.stop()
+        # Stale talk stamps are already ignored by queries; the rewrite is only housekeeping.
+        # Interrupted upgrades resume with the next run's first write
+        tasks = list(self._talk_cleanups.values()) + list(self._upgrades.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.write_buffer.stop()
+        # Joining the database threads blocks, so keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.connections.close_all)
+
+    async def _write(self, game_name: str, fn: Callable[[sqlite3.Connection], Any], transaction: bool = True) -> Any:
+        """Run fn(conn) on the game's writer thread and await it.
+
+        fn runs inside one BEGIN IMMEDIATE transaction unless transaction=False,
+        which suits single statements that are atomic on their own.
+        """
+        await self._ensure_upgraded(game_name)
+        return await self.connections.run_write(game_name, fn, transaction)
+
+    async def _ensure_upgraded(self, game_name: str):
+        """Check the game table's schema on its first write in this worker.
+
+        Small tables are upgraded on the spot. Larger ones (deduplicating
+        accounts, building indexes) are upgraded by a background task, one
+        writer job per chunk or index, so writes keep flowing in between;
+        until the table has UNIQUE(account) inserts avoid ON CONFLICT.
+        """
+        if game_name in self._upgraded:
+            return
+
+        def check(conn: sqlite3.Connection) -> Optional[Tuple[list, bool]]:
+            steps = upgrade_steps(conn, game_name)
+            if steps is None:
+                return None
+            if steps and is_small_table(conn, game_name):
+                run_steps(conn, steps)
+                steps = []
+            return steps, has_unique_account(conn, game_name)
+        checked = await self.connections.run_write(game_name, check, transaction=False)
+        if checked is None:
+            # No table yet; checked again once new_game creates it
+            return
+        steps, unique = checked
+        if not unique:
+            self._legacy_tables.add(game_name)
+        if steps and game_name not in self._upgrades:
+            self._start_upgrade(game_name, steps)
+        self._upgraded.add(game_name)
+
+    def _start_upgrade(self, game_name: str, steps: list):
+        logger.info(f"Upgrading {game_name} in the background ({len(steps)} steps)")
+        task = asyncio.ensure_future(self._upgrade(game_name, steps))
+        self._upgrades[game_name] = task
+
+        def done(t: asyncio.Task):
+            if self._upgrades.get(game_name) is t:
+                del self._upgrades[game_name]
+            if t.cancelled():
+                return
+            if t.exception() is not None:
+                logger.error(f"Schema upgrade failed for {game_name}: {t.exception()}")
+                # Retried after the next write checks the table again
+                self._upgraded.discard(game_name)
+        task.add_done_callback(done)
+
+    async def _upgrade(self, game_name: str, steps: list):
+        """Run upgrade steps as separate writer jobs; writes queued meanwhile run between them."""
+        for step in steps:
+            while await self.connections.run_write(game_name, step, transaction=False):
+                pass
+        if await self.connections.run_read(game_name, lambda conn: has_unique_account(conn, game_name)):
+            self._legacy_tables.discard(game_name)
+        logger.info(f"Upgraded {game_name}")
 
     def _get_time_str(self, dt: Optional[datetime] = None) -> str:
         if dt is None:
             dt = datetime.now()
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
+        return dt.strftime(TIME_FORMAT)
+
+    async def _uses_epoch(self, game_name: str) -> bool:
+        """Whether a game table stores INTEGER epoch seconds (cached; tables are converted offline)."""
+        epoch = self._epoch_tables.get(game_name)
+        if epoch is None:
+            epoch = await self.connections.run_read(game_name, lambda conn: is_epoch_table(conn, game_name))
+            if epoch is None:
+                # No table yet; let the statement itself report the missing table
+                return False
+            self._epoch_tables[game_name] = epoch
+        return epoch
+
+    def _time_value(self, epoch: bool, minutes_ago: int = 0):
+        """Current time (optionally shifted back) in the representation a table stores."""
+        if epoch:
+            return int(time.time()) - minutes_ago * 60
+        if minutes_ago:
+            return self._get_time_str(datetime.now() - timedelta(minutes=minutes_ago))
+        return self._get_time_str()
+
+    def _render_time(self, value):
+        """API form of a stored time value: epoch seconds become text, text is returned as is."""
+        if isinstance(value, int):
+            return TALK_RESET_STR if value == 0 else datetime.fromtimestamp(value).strftime(TIME_FORMAT)
+        return value
+
+    def _claim_stamp(self, now, reset_at):
+        """Talk stamp for a claim: never below the channel's reset time, so it is not mistaken for a cleared stamp."""
+        return now if reset_at is None or now >= reset_at else reset_at
+
+    def _talk_resets(self, conn: sqlite3.Connection, game_name: str) -> Dict[int, Any]:
+        """Latest reset time per talk channel of a game, in the table's time representation."""
+        try:
+            rows = conn.execute(
+                "SELECT channel, reset_at FROM _talk_resets WHERE game_name = ?", (game_name,)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # Database not upgraded yet, so no channel was ever reset this way
+            return {}
+        return {row[0]: row[1] for row in rows}
+
+    def _row_dict(self, row: sqlite3.Row, epoch: bool, resets: Optional[Dict[int, Any]] = None) -> dict:
+        """Row as returned by the API; stamps older than a channel reset show as cleared,
+        and epoch columns are rendered in the text format."""
+        data = dict(row)
+        for channel, reset_at in (resets or {}).items():
+            field = f"last_talk_time{channel}"
+            value = data.get(field)
+            if value is not None and reset_at is not None and value < reset_at:
+                data[field] = 0 if epoch else TALK_RESET_STR
+        if epoch:
+            for field in TIME_FIELDS:
+                data[field] = self._render_time(data.get(field))
+        return data
+
+    def _to_ts(self, value) -> float:
+        """Epoch seconds of a stored time value (text or INTEGER)."""
+        if value is None:
+            return 0.0
+        if isinstance(value, int):
+            return float(value)
+        return datetime.strptime(value, TIME_FORMAT).timestamp()
+
+    def _hot_entry(self, row: sqlite3.Row, epoch: bool, resets: Dict[int, Any]) -> HotEntry:
+        data = self._row_dict(row, epoch, resets)
+        talk = [0.0] + [self._to_ts(data[f"last_talk_time{channel}"]) for channel in range(1, 7)]
+        return HotEntry(data, self._to_ts(row["online_time"]), talk)
+
+    async def _hot(self, game_name: str) -> Optional[GameHotSet]:
+        """The game's hot set, loading it from SQLite on first use. None when disabled."""
+        if not self._hot_enabled:
+            return None
+        hot = self.hot_set.get(game_name)
+        if hot is not None:
+            return hot
+        async with self.locker.hold(game_name):
+            hot = self.hot_set.get(game_name)
+            if hot is not None:
+                return hot
+            epoch = await self._uses_epoch(game_name)
+            await self._check_table(game_name)
+            # Heartbeats committed while loading are picked up again on the next heartbeat
+            cutoff = self._time_value(epoch, int(self.hot_set.window // 60) + 1)
+            load_sql = f'SELECT * FROM "{game_name}" WHERE online_time > ?'
+
+            def load(conn: sqlite3.Connection) -> GameHotSet:
+                # On the writer thread: no claim can commit between reading the talk stamps
+                # and installing the set, after which claims mirror into it (_hot_claimed)
+                resets = self._talk_resets(conn, game_name)
+                entries = [self._hot_entry(row, epoch, resets) for row in conn.execute(load_sql, (cutoff,))]
+                hot = GameHotSet(self.hot_set.window)
+                with hot.lock:
+                    for channel, reset_at in resets.items():
+                        if 1 <= channel <= 6:
+                            hot.talk_floor[channel] = reset_at
+                    for entry in sorted(entries, key=lambda e: e.online):
+                        hot.add(entry)
+                    hot.evict()
+                return self.hot_set.install(game_name, hot)
+            return await self._write(game_name, load, transaction=False)
+
+    async def _hot_refresh(self, game_name: str, rows: List[PendingRow]):
+        """Mirror committed heartbeats into the game's hot set, if it is loaded."""
+        hot = self.hot_set.get(game_name) if rows else None
+        if hot is None:
+            return
+        epoch = await self._uses_epoch(game_name)
+        missing = []
+        with hot.lock:
+            for _, account, b_zone, s_zone, rating, online_time in rows:
+                online_str = self._render_time(online_time)
+                if not hot.refresh(account, b_zone, s_zone, rating, self._to_ts(online_time), online_str):
+                    missing.append(account)
+            hot.evict()
+        # New accounts need their full row (id, created_at, talk times)
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            fetch_sql = f'SELECT * FROM "{game_name}" WHERE account IN ({placeholders})'
+
+            def fetch(conn: sqlite3.Connection, fetch_sql=fetch_sql, chunk=chunk):
+                # On the writer thread, like load in _hot, so the talk stamps cannot miss a claim
+                resets = self._talk_resets(conn, game_name)
+                fetched = [self._hot_entry(row, epoch, resets) for row in conn.execute(fetch_sql, chunk)]
+                with hot.lock:
+                    for entry in fetched:
+                        hot.add(entry)
+            await self._write(game_name, fetch, transaction=False)
+
+    async def _hot_query(self, hot: GameHotSet, req: QueryReq, epoch: bool, cnt: int) -> List[dict]:
+        """Answer a /query from memory; claims stamp the hot set and SQLite on the writer thread."""
+        now = int(time.time())
+        cutoff = now - req.OnlineDuration * 60
+        channel = req.TalkChannel if req.TalkChannel > 0 else 0
+        talk_field = self._get_talk_channel_field(channel) if channel else None
+        if not talk_field:
+            with hot.lock:
+                hot.evict(now)
+                entries = hot.select(req.Account, req.BZone, req.SZone, req.Rating, cutoff, 0, cutoff, cnt)
+                return [dict(entry.row) for entry in entries]
+
+        def claim(conn: sqlite3.Connection) -> List[dict]:
+            # Serialized with the SQL claims of the game (which mirror into the hot set), so an
+            # account is never handed out twice; memory is stamped only once the UPDATE succeeded
+            with hot.lock:
+                hot.evict(now)
+                entries = hot.select(req.Account, req.BZone, req.SZone, req.Rating, cutoff, channel, cutoff, cnt)
+                if not entries:
+                    return []
+                now_value = self._claim_stamp(self._time_value(epoch), hot.talk_floor[channel])
+                ids = [entry.row["id"] for entry in entries]
+                placeholders = ','.join(['?'] * len(ids))
+                conn.execute(f'UPDATE "{req.GameName}" SET {talk_field} = ? WHERE id IN ({placeholders})',
+                             [now_value] + ids)
+                now_ts = self._to_ts(now_value)
+                now_str = self._render_time(now_value)
+                for entry in entries:
+                    entry.talk[channel] = now_ts
+                    entry.row[talk_field] = now_str
+                return [dict(entry.row) for entry in entries]
+        return await self._write(req.GameName, claim)
+
+    def _hot_claimed(self, game_name: str, channel: int, rows: List[dict], stamp):
+        """Mirror a SQL claim into the game's hot set, if loaded. Runs in the claim's writer transaction."""
+        hot = self.hot_set.get(game_name)
+        if hot is None or not rows:
+            return
+        stamp_ts = self._to_ts(stamp)
+        stamp_str = self._render_time(stamp)
+        with hot.lock:
+            for row in rows:
+                hot.stamp(row["account"], channel, stamp_ts, stamp_str)
 
     def _get_talk_channel_field(self, channel: int) -> str:
         if 1 <= channel <= 6:
             return f"last_talk_time{channel}"
         raise ValueError(f"喊话通道{channel}暂无")
 
-    def new_game(self, game_name: str):
-        lock = self.locker.get_lock(game_name)
-        with lock:
-            auto_migrate(game_name)
-
-    def insert(self, base: BaseInfo):
-        # 1. Acquire Lock for the game
-        lock = self.locker.get_lock(base.GameName)
-        with lock:
-            # 2. Get (or create) connection (safe to use inside lock)
-            conn = self._get_connection_pooled(base.GameName)
-            try:
-                cursor = conn.cursor()
-                # Check if exists
-                cursor.execute(f'SELECT id FROM "{base.GameName}" WHERE account = ?', (base.Account,))
-                row = cursor.fetchone()
-                
-                now_str = self._get_time_str()
-                
-                if row:
-                    # Update
-                    cursor.execute(f'''
-                        UPDATE "{base.GameName}" 
-                        SET b_zone = ?, s_zone = ?, rating = ?, online_time = ?
-                        WHERE account = ?
-                    ''', (base.BZone, base.SZone, base.Rating, now_str, base.Account))
-                else:
-                    # Insert
-                    cursor.execute(f'''
-                        INSERT INTO "{base.GameName}" (game_name, account, b_zone, s_zone, rating, online_time, created_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (base.GameName, base.Account, base.BZone, base.SZone, base.Rating, now_str, now_str))
-                conn.commit()
-            except Exception as e:
-                # We don't close pooled connection, but we might want to rollback on error?
-                # SQLite automatically rolls back on close, but we aren't closing.
-                # So explicit rollback is good practice if we want to reuse it.
-                conn.rollback()
-                raise e
-
-    def update(self, base: BaseInfo):
-        lock = self.locker.get_lock(base.GameName)
-        with lock:
-            conn = self._get_connection_pooled(base.GameName)
+    async def new_game(self, game_name: str, profile: Optional[str] = None):
+        if profile is not None:
+            await self._register_profile(game_name, profile)
+        async with self.locker.hold(game_name):
+            # On the writer's own connection, which for an in-memory profile is the only way to reach the data
+            await self.connections.run_write(
+                game_name, lambda conn: auto_migrate(game_name, conn, upgrade=False), transaction=False
+            )
+        self._epoch_tables.pop(game_name, None)
+        # A new table is upgraded at once; an existing one may need the background upgrade
+        self._upgraded.discard(game_name)
+        await self._ensure_upgraded(game_name)
+
+    async def _register_profile(self, game_name: str, profile: str):
+        settings = config.DURABILITY_PROFILES.get(profile)
+        if settings is None:
+            raise ValueError(f"unknown durability profile: {profile}")
+        if settings.get("in_memory") and config.WORKERS > 1:
+            # Each worker process would hold its own copy of the data
+            raise ValueError(f"durability profile {profile} requires WORKERS = 1")
+        catalog = self.connections.catalog
+        if (profile != config.DEFAULT_PROFILE and await catalog.lookup(game_name) is None
+                and await self._table_exists(game_name)):
+            # Its rows already live in the default profile's database file
+            raise ValueError(f"{game_name} already exists with durability profile {config.DEFAULT_PROFILE}")
+        await catalog.register(game_name, profile)
+
+    async def _buffered(self, game_name: str) -> bool:
+        """Whether /insert for the game goes through the write-behind buffer (see DURABILITY_PROFILES)."""
+        profile = await self.connections.catalog.profile(game_name)
+        setting = config.DURABILITY_PROFILES.get(profile, {}).get("write_behind")
+        return config.WRITE_BEHIND_ENABLED if setting is None else setting
+
+    def _apply_inserts(self, conn: sqlite3.Connection, game_name: str, rows: List[PendingRow]):
+        """Upsert rows into a game table in one statement batch. Caller commits."""
+        if game_name in self._legacy_tables:
+            self._apply_inserts_legacy(conn, game_name, rows)
+            return
+        upsert_sql = self.statements.get((game_name, "upsert", 0, 0), lambda: f'''
+            INSERT INTO "{game_name}" (game_name, account, b_zone, s_zone, rating, online_time, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(account) DO UPDATE SET
+                b_zone = excluded.b_zone,
+                s_zone = excluded.s_zone,
+                rating = excluded.rating,
+                online_time = excluded.online_time
+        ''')
+        conn.executemany(upsert_sql, [(game, account, b_zone, s_zone, rating, online_time, online_time)
+                                      for game, account, b_zone, s_zone, rating, online_time in rows])
+
+    def _apply_inserts_legacy(self, conn: sqlite3.Connection, game_name: str, rows: List[PendingRow]):
+        """Upsert without ON CONFLICT, for a table still waiting for UNIQUE(account).
+
+        Updates the account's rows and inserts only if there were none. Both run in
+        the caller's BEGIN IMMEDIATE transaction, so no duplicate can appear while the
+        background upgrade removes the old ones.
+        """
+        update_sql = self.statements.get((game_name, "update", 0, 0), lambda: self._update_sql(game_name))
+        insert_sql = self.statements.get((game_name, "insert", 0, 0), lambda: f'''
+            INSERT INTO "{game_name}" (game_name, account, b_zone, s_zone, rating, online_time, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''')
+        for game, account, b_zone, s_zone, rating, online_time in rows:
+            if conn.execute(update_sql, (b_zone, s_zone, rating, online_time, account)).rowcount == 0:
+                conn.execute(insert_sql, (game, account, b_zone, s_zone, rating, online_time, online_time))
+
+    def _drain_pending(self, conn: sqlite3.Connection, game_name: str) -> List[PendingRow]:
+        """Apply buffered heartbeats for a game. Runs on the writer thread, which keeps flushes ordered.
+
+        The rows go back into the buffer unless they are committed: at once if
+        applying them fails, otherwise if the enclosing transaction rolls back.
+        """
+        rows = self.write_buffer.take(game_name)
+        if not rows:
+            return rows
+        # Undoes a partly applied batch, since a caller may catch the error and commit the rest
+        conn.execute("SAVEPOINT drain_pending")
+        try:
+            self._apply_inserts(conn, game_name, rows)
+            conn.execute("RELEASE drain_pending")
+        except Exception as e:
+            conn.execute("ROLLBACK TO drain_pending")
+            conn.execute("RELEASE drain_pending")
+            self.write_buffer.restore(game_name, rows)
+            raise e
+        on_rollback(lambda: self.write_buffer.restore(game_name, rows))
+        return rows
+
+    async def _table_exists(self, game_name: str) -> bool:
+        row = await self.connections.run_read(game_name, lambda conn: conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (game_name,)
+        ).fetchone())
+        return row is not None
+
+    async def _check_table(self, game_name: str):
+        """Fail fast for unknown games, since buffered rows are acknowledged before they are written."""
+        if game_name in self._known_tables:
+            return
+        if not await self._table_exists(game_name):
+            raise ValueError(f"no such table: {game_name}")
+        self._known_tables.add(game_name)
+
+    async def flush_pending(self, game_name: str):
+        rows = await self._write(game_name, lambda conn: self._drain_pending(conn, game_name))
+        await self._hot_refresh(game_name, rows)
+
+    async def insert(self, base: BaseInfo):
+        buffered = await self._buffered(base.GameName)
+        if buffered:
+            await self._check_table(base.GameName)
+        now = self._time_value(await self._uses_epoch(base.GameName))
+        row = (base.GameName, base.Account, base.BZone, base.SZone, base.Rating, now)
+        if buffered:
+            # Acknowledge immediately; the row is written with the next batch
+            if self.write_buffer.add(row):
+                await self.flush_pending(base.GameName)
+            return
+
+        await self._write(base.GameName, lambda conn: self._apply_inserts(conn, base.GameName, [row]))
+        await self._hot_refresh(base.GameName, [row])
+
+    def _update_sql(self, game_name: str) -> str:
+        return f'''
+            UPDATE "{game_name}"
+            SET b_zone = ?, s_zone = ?, rating = ?, online_time = ?
+            WHERE account = ?
+        '''
+
+    def _apply_updates(self, conn: sqlite3.Connection, game_name: str, rows: List[PendingRow]) -> List[bool]:
+        """Update existing accounts, one statement per row. Caller commits. Returns whether each row matched."""
+        update_sql = self.statements.get((game_name, "update", 0, 0), lambda: self._update_sql(game_name))
+        return [conn.execute(update_sql, (b_zone, s_zone, rating, online_time, account)).rowcount > 0
+                for _, account, b_zone, s_zone, rating, online_time in rows]
+
+    async def update(self, base: BaseInfo):
+        now = self._time_value(await self._uses_epoch(base.GameName))
+        row = (base.GameName, base.Account, base.BZone, base.SZone, base.Rating, now)
+
+        def apply(conn: sqlite3.Connection) -> List[PendingRow]:
+            # A buffered heartbeat must not land after (and overwrite) this update. Only this
+            # worker's buffer is drained; see Config.WRITE_BEHIND_ENABLED for WORKERS > 1
+            drained = self._drain_pending(conn, base.GameName)
+            matched = self._apply_updates(conn, base.GameName, [row])
+            return drained + [row] if matched[0] else drained
+        written = await self._write(base.GameName, apply)
+        await self._hot_refresh(base.GameName, written)
+
+    async def _apply_batch(self, bases: List[BaseInfo],
+                           write: Callable[[sqlite3.Connection, str, List[PendingRow]], List[bool]],
+                           admit: Optional[Callable[[str], AsyncContextManager]] = None) -> List[dict]:
+        """Group rows by game, write each database file in one transaction and report per-row status.
+
+        With admit (AdmissionController.slot) every game holds one of its slots while
+        its rows are written; a game that is not admitted gets the error for its rows.
+
+        write(conn, game_name, rows) runs on the writer and returns whether each
+        row matched; a row that did not (an update of a missing account) is
+        reported as an error. Games stored in the same file (see
+        Config.STORAGE_LAYOUT) share one transaction and commit, each under its
+        own savepoint so a failing game does not undo the others. A game's
+        buffered heartbeats are written before its savepoint, so they are kept
+        even if its batch fails. Files are awaited together so their writers
+        work in parallel.
+        """
+        groups: Dict[str, List[int]] = {}
+        for i, base in enumerate(bases):
+            groups.setdefault(base.GameName, []).append(i)
+        files: Dict[Tuple[str, str], List[str]] = {}
+        for game_name in groups:
+            files.setdefault(await self.connections.locate(game_name), []).append(game_name)
+
+        results: List[Optional[dict]] = [None] * len(bases)
+
+        def report(game_name: str, status: dict, indexes: Optional[List[int]] = None):
+            for i in groups[game_name] if indexes is None else indexes:
+                results[i] = dict(status, game_name=game_name, account=bases[i].Account)
+
+        async def run(location: Tuple[str, str], game_names: List[str]):
+            async with AsyncExitStack() as slots:
+                await write_file(location, game_names, slots)
+
+        async def write_file(location: Tuple[str, str], game_names: List[str], slots: AsyncExitStack):
+            rows: Dict[str, List[PendingRow]] = {}
+            # Sorted, so batches acquire the slots of shared games in the same order
+            for game_name in sorted(game_names):
+                try:
+                    if admit is not None:
+                        await slots.enter_async_context(admit(game_name))
+                    await self._ensure_upgraded(game_name)
+                    now = self._time_value(await self._uses_epoch(game_name))
+                    rows[game_name] = [(game_name, bases[i].Account, bases[i].BZone, bases[i].SZone, bases[i].Rating, now)
+                                       for i in groups[game_name]]
+                except Exception as e:
+                    report(game_name, {"error": str(e)})
+            if not rows:
+                return
+
+            def apply(conn: sqlite3.Connection) -> Dict[str, Tuple[List[PendingRow], Any]]:
+                written = {}
+                for game_name, game_rows in rows.items():
+                    try:
+                        # Older buffered heartbeats go first so they cannot overwrite this batch
+                        drained = self._drain_pending(conn, game_name)
+                    except Exception as e:
+                        written[game_name] = ([], e)
+                        continue
+                    conn.execute("SAVEPOINT batch_game")
+                    try:
+                        matched = write(conn, game_name, game_rows)
+                        conn.execute("RELEASE batch_game")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO batch_game")
+                        conn.execute("RELEASE batch_game")
+                        matched = e
+                    written[game_name] = (drained, matched)
+                return written
+
             try:
-                now_str = self._get_time_str()
-                cursor = conn.cursor()
-                cursor.execute(f'''
-                    UPDATE "{base.GameName}" 
-                    SET b_zone = ?, s_zone = ?, rating = ?, online_time = ?
-                    WHERE account = ?
-                ''', (base.BZone, base.SZone, base.Rating, now_str, base.Account))
-                conn.commit()
+                written = await self.connections.run_write_path(location[0], apply, profile=location[1])
             except Exception as e:
-                conn.rollback()
-                raise e
+                for game_name in rows:
+                    report(game_name, {"error": str(e)})
+                return
+            for game_name, (drained, matched) in written.items():
+                try:
+                    if isinstance(matched, Exception):
+                        await self._hot_refresh(game_name, drained)
+                        raise matched
+                    await self._hot_refresh(game_name, drained + [row for row, ok in zip(rows[game_name], matched) if ok])
+                    report(game_name, {"message": "success"},
+                           [i for i, ok in zip(groups[game_name], matched) if ok])
+                    report(game_name, {"error": f"no such account in {game_name}"},
+                           [i for i, ok in zip(groups[game_name], matched) if not ok])
+                except Exception as e:
+                    report(game_name, {"error": str(e)})
 
-    def query(self, req: QueryReq) -> List[dict]:
-        lock = self.locker.get_lock(req.GameName)
-        with lock:
-            conn = self._get_connection_pooled(req.GameName)
-            try:
-                cursor = conn.cursor()
-                query_sql = f'SELECT * FROM "{req.GameName}" WHERE 1=1'
-                params = []
-
-                if req.Account:
-                    query_sql += " AND account = ?"
-                    params.append(req.Account)
-                if req.BZone:
-                    query_sql += " AND b_zone = ?"
-                    params.append(req.BZone)
-                if req.SZone:
-                    query_sql += " AND s_zone = ?"
-                    params.append(req.SZone)
-                if req.Rating and req.Rating != 0:
-                    query_sql += " AND rating = ?"
-                    params.append(req.Rating)
-                
-                if req.OnlineDuration > 0:
-                    target_time = datetime.now() - timedelta(minutes=req.OnlineDuration)
-                    target_time_str = self._get_time_str(target_time)
-                    # online_time > target_time (User was online recently)
-                    query_sql += " AND online_time > ?"
-                    params.append(target_time_str)
-
-                talk_field = None
-                if req.TalkChannel > 0:
-                    talk_field = self._get_talk_channel_field(req.TalkChannel)
-                    target_time = datetime.now() - timedelta(minutes=req.OnlineDuration)
-                    target_time_str = self._get_time_str(target_time)
-                    # last_talk_time < target_time (User hasn't talked recently)
-                    query_sql += f" AND {talk_field} < ?"
-                    params.append(target_time_str)
-
-                cnt = req.Cnt if req.Cnt > 0 else 1
-                query_sql += " LIMIT ?"
-                params.append(cnt)
-
-                cursor.execute(query_sql, params)
-                rows = cursor.fetchall()
-                
-                results = []
-                ids_to_update = []
-                for row in rows:
-                    results.append(dict(row))
-                    ids_to_update.append(row['id'])
-
-                # Update talk time for returned rows if channel specified
-                if talk_field and ids_to_update:
-                    now_str = self._get_time_str()
-                    placeholders = ','.join(['?'] * len(ids_to_update))
-                    update_sql = f'UPDATE "{req.GameName}" SET {talk_field} = ? WHERE id IN ({placeholders})'
-                    update_params = [now_str] + ids_to_update
-                    cursor.execute(update_sql, update_params)
-                    conn.commit()
+        await asyncio.gather(*(run(location, game_names) for location, game_names in files.items()))
+        return results
+
+    async def insert_batch(self, bases: List[BaseInfo],
+                           admit: Optional[Callable[[str], AsyncContextManager]] = None) -> List[dict]:
+        def write(conn: sqlite3.Connection, game_name: str, rows: List[PendingRow]) -> List[bool]:
+            self._apply_inserts(conn, game_name, rows)
+            return [True] * len(rows)
+        return await self._apply_batch(bases, write, admit)
+
+    async def update_batch(self, bases: List[BaseInfo],
+                           admit: Optional[Callable[[str], AsyncContextManager]] = None) -> List[dict]:
+        return await self._apply_batch(bases, self._apply_updates, admit)
+
+    def _query_params(self, req: QueryReq, epoch: bool) -> Tuple[int, list, Optional[str]]:
+        """Predicate bitmask, parameters (without LIMIT) and talk field for a query."""
+        mask = 0
+        params = []
+
+        if req.Account:
+            mask |= PRED_ACCOUNT
+            params.append(req.Account)
+        if req.BZone:
+            mask |= PRED_B_ZONE
+            params.append(req.BZone)
+        if req.SZone:
+            mask |= PRED_S_ZONE
+            params.append(req.SZone)
+        if req.Rating and req.Rating != 0:
+            mask |= PRED_RATING
+            params.append(req.Rating)
+
+        # online_time > target_time (User was online recently) and
+        # last_talk_time < target_time (User hasn't talked recently) share one cutoff
+        target_time = self._time_value(epoch, req.OnlineDuration)
+        if req.OnlineDuration > 0:
+            mask |= PRED_ONLINE
+            params.append(target_time)
+
+        talk_field = None
+        if req.TalkChannel > 0:
+            talk_field = self._get_talk_channel_field(req.TalkChannel)
+            mask |= PRED_TALK
+            params.append(target_time)
+
+        return mask, params, talk_field
+
+    def _where_sql(self, mask: int, talk_field: Optional[str]) -> str:
+        where_sql = '1=1'
+        if mask & PRED_ACCOUNT:
+            where_sql += " AND account = ?"
+        if mask & PRED_B_ZONE:
+            where_sql += " AND b_zone = ?"
+        if mask & PRED_S_ZONE:
+            where_sql += " AND s_zone = ?"
+        if mask & PRED_RATING:
+            where_sql += " AND rating = ?"
+        if mask & PRED_ONLINE:
+            where_sql += " AND online_time > ?"
+        if mask & PRED_TALK:
+            where_sql += f" AND {talk_field} < ?"
+        return where_sql
+
+    def _query_sql(self, game_name: str, kind: str, mask: int, channel: int, talk_field: Optional[str]) -> str:
+        def build() -> str:
+            where_sql = self._where_sql(mask, talk_field)
+            if kind == "claim":
+                return f'''
+                    UPDATE "{game_name}" SET {talk_field} = ?
+                    WHERE id IN (SELECT id FROM "{game_name}" WHERE {where_sql} LIMIT ?)
+                    RETURNING *
+                '''
+            if kind == "page":
+                # Keyset page for streamed reads: the next rows after the last id sent
+                return f'SELECT * FROM "{game_name}" WHERE {where_sql} AND id > ? ORDER BY id LIMIT ?'
+            return f'SELECT * FROM "{game_name}" WHERE {where_sql} LIMIT ?'
+        return self.statements.get((game_name, kind, mask, channel), build)
 
+    async def query(self, req: QueryReq) -> List[dict]:
+        rows = await self._query(req)
+        ROWS_RETURNED.inc(req.GameName, "claim" if req.TalkChannel > 0 else "read", amount=len(rows))
+        return rows
+
+    async def query_stream(self, req: QueryReq) -> AsyncIterator[List[dict]]:
+        """query() in batches of at most STREAM_BATCH_SIZE rows, so a large Cnt is never held in memory.
+
+        Claims stamp each batch in its own transaction; stamped rows no longer match, so the
+        next batch continues with the rest. Reads page through the matches in id order.
+        Always yields at least one (possibly empty) batch.
+        """
+        remaining = req.Cnt if req.Cnt > 0 else 1
+        batch_size = max(1, config.STREAM_BATCH_SIZE)
+        kind = "claim" if req.TalkChannel > 0 else "read"
+        last_id = 0
+        while True:
+            size = min(batch_size, remaining)
+            if kind == "claim":
+                rows = await self._query(req, size)
+            else:
+                rows = await self._read_page(req, last_id, size)
+            ROWS_RETURNED.inc(req.GameName, kind, amount=len(rows))
+            yield rows
+            remaining -= len(rows)
+            if len(rows) < size or remaining <= 0:
+                return
+            if kind == "read":
+                last_id = rows[-1]["id"]
+
+    async def _read_page(self, req: QueryReq, last_id: int, size: int) -> List[dict]:
+        epoch = await self._uses_epoch(req.GameName)
+        mask, params, _ = self._query_params(req, epoch)
+        params += [last_id, size]
+        page_sql = self._query_sql(req.GameName, "page", mask, 0, None)
+
+        def read(conn: sqlite3.Connection) -> List[dict]:
+            resets = self._talk_resets(conn, req.GameName)
+            return [self._row_dict(row, epoch, resets) for row in conn.execute(page_sql, params)]
+        return await self.connections.run_read(req.GameName, read)
+
+    async def _query(self, req: QueryReq, cnt: Optional[int] = None) -> List[dict]:
+        """Rows for a /query; cnt overrides req.Cnt (used by query_stream for one batch)."""
+        if cnt is None:
+            cnt = req.Cnt if req.Cnt > 0 else 1
+        epoch = await self._uses_epoch(req.GameName)
+        if self._hot_enabled and 0 < req.OnlineDuration * 60 <= self.hot_set.window:
+            hot = await self._hot(req.GameName)
+            if hot is not None:
+                return await self._hot_query(hot, req, epoch, cnt)
+        mask, params, talk_field = self._query_params(req, epoch)
+        params.append(cnt)
+
+        if talk_field is None:
+            # Pure read: served by a reader thread, concurrently with the writer
+            query_sql = self._query_sql(req.GameName, "select", mask, 0, None)
+
+            def read(conn: sqlite3.Connection) -> List[dict]:
+                resets = self._talk_resets(conn, req.GameName)
+                return [self._row_dict(row, epoch, resets) for row in conn.execute(query_sql, params)]
+            return await self.connections.run_read(req.GameName, read)
+
+        now = self._time_value(epoch)
+
+        def claim_params(resets: Dict[int, Any]) -> list:
+            # A stamp older than the channel's last reset counts as cleared, so the
+            # talk cutoff (just before LIMIT) is raised to the reset time
+            reset_at = resets.get(req.TalkChannel)
+            if reset_at is None or reset_at <= params[-2]:
+                return params
+            return params[:-2] + [reset_at, params[-1]]
+
+        if SUPPORTS_RETURNING:
+            # Select and stamp in a single statement: atomic without an explicit transaction,
+            # and the returned rows already carry the new talk time
+            claim_sql = self._query_sql(req.GameName, "claim", mask, req.TalkChannel, talk_field)
+
+            def claim_returning(conn: sqlite3.Connection) -> List[dict]:
+                resets = self._talk_resets(conn, req.GameName)
+                stamp = self._claim_stamp(now, resets.get(req.TalkChannel))
+                rows = conn.execute(claim_sql, [stamp] + claim_params(resets)).fetchall()
+                results = [self._row_dict(row, epoch, resets) for row in rows]
+                self._hot_claimed(req.GameName, req.TalkChannel, results, stamp)
                 return results
-            except Exception as e:
-                # Query usually doesn't need rollback unless update failed
-                conn.rollback()
-                raise e
-
-    def clear_talk_time(self, game_name: str, channel: int):
-        lock = self.locker.get_lock(game_name)
-        with lock:
-            conn = self._get_connection_pooled(game_name)
-            try:
-                talk_field = self._get_talk_channel_field(channel)
-                cursor = conn.cursor()
-                cursor.execute(f'UPDATE "{game_name}" SET {talk_field} = ?', ('2000-01-01 00:00:00',))
-                conn.commit()
-            except Exception as e:
-                conn.rollback()
-                raise e
+            # In one transaction with the reset lookup, so a concurrent reset from another worker is seen
+            return await self._write(req.GameName, claim_returning)
+
+        query_sql = self._query_sql(req.GameName, "select", mask, req.TalkChannel, talk_field)
+
+        def claim(conn: sqlite3.Connection) -> List[dict]:
+            # Select and stamp in the same BEGIN IMMEDIATE transaction so two bots never get
+            # the same row, even when they hit different worker processes
+            resets = self._talk_resets(conn, req.GameName)
+            rows = conn.execute(query_sql, claim_params(resets)).fetchall()
+            results = [self._row_dict(row, epoch, resets) for row in rows]
+            ids_to_update = [row['id'] for row in rows]
+            if ids_to_update:
+                placeholders = ','.join(['?'] * len(ids_to_update))
+                update_sql = f'UPDATE "{req.GameName}" SET {talk_field} = ? WHERE id IN ({placeholders})'
+                stamp = self._claim_stamp(now, resets.get(req.TalkChannel))
+                conn.execute(update_sql, [stamp] + ids_to_update)
+                self._hot_claimed(req.GameName, req.TalkChannel, results, stamp)
+            return results
+
+        return await self._write(req.GameName, claim)
+
+    async def explain(self, req: QueryReq) -> List[dict]:
+        """EXPLAIN QUERY PLAN for the statement query(req) would run, without running it."""
+        epoch = await self._uses_epoch(req.GameName)
+        mask, params, talk_field = self._query_params(req, epoch)
+        params.append(req.Cnt if req.Cnt > 0 else 1)
+        if talk_field is not None and SUPPORTS_RETURNING:
+            query_sql = self._query_sql(req.GameName, "claim", mask, req.TalkChannel, talk_field)
+            params = [self._time_value(epoch)] + params
+        else:
+            query_sql = self._query_sql(req.GameName, "select", mask, req.TalkChannel, talk_field)
+        rows = await self.connections.run_read(
+            req.GameName, lambda conn: conn.execute("EXPLAIN QUERY PLAN " + query_sql, params).fetchall()
+        )
+        return [{"id": row[0], "parent": row[1], "detail": row[3]} for row in rows]
+
+    async def clear_talk_time(self, game_name: str, channel: int):
+        """Reset a talk channel in O(1): record the reset time and let queries treat older
+        stamps as cleared. The stamps themselves are rewritten in the background."""
+        self._get_talk_channel_field(channel)
+        epoch = await self._uses_epoch(game_name)
+        await self._check_table(game_name)
+        # Stamps have one-second resolution: everything up to this second is cleared, and
+        # later claims stamp at least reset_at (see _claim_stamp), so the cut is exact
+        if epoch:
+            reset_at = int(time.time()) + 1
+        else:
+            reset_at = self._get_time_str(datetime.now() + timedelta(seconds=1))
+        await self._write(game_name, lambda conn: conn.execute(
+            "INSERT INTO _talk_resets (game_name, channel, reset_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(game_name, channel) DO UPDATE SET reset_at = excluded.reset_at",
+            (game_name, channel, reset_at),
+        ), transaction=False)
+        hot = self.hot_set.get(game_name)
+        if hot is not None:
+            cleared = 0 if epoch else TALK_RESET_STR
+            hot.reset_talk(channel, self._to_ts(cleared), TALK_RESET_STR, reset_at)
+
+        previous = self._talk_cleanups.pop((game_name, channel), None)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.ensure_future(self._clear_stale_talk(game_name, channel, reset_at, epoch))
+        self._talk_cleanups[(game_name, channel)] = task
+
+        def done(t: asyncio.Task):
+            if self._talk_cleanups.get((game_name, channel)) is t:
+                del self._talk_cleanups[(game_name, channel)]
+            if not t.cancelled() and t.exception() is not None:
+                logger.error(f"Talk channel cleanup failed for {game_name}/{channel}: {t.exception()}")
+        task.add_done_callback(done)
+
+    async def _clear_stale_talk(self, game_name: str, channel: int, reset_at, epoch: bool):
+        """Rewrite stamps older than reset_at to the cleared value, TALK_RESET_CHUNK ids per transaction."""
+        talk_field = self._get_talk_channel_field(channel)
+        cleared = 0 if epoch else TALK_RESET_STR
+        max_id = await self.connections.run_read(
+            game_name, lambda conn: conn.execute(f'SELECT MAX(id) FROM "{game_name}"').fetchone()[0]
+        ) or 0
+        chunk_sql = (f'UPDATE "{game_name}" SET {talk_field} = ? '
+                     f'WHERE id > ? AND id <= ? AND {talk_field} < ? AND {talk_field} > ?')
+        chunk = max(1, config.TALK_RESET_CHUNK)
+        for low in range(0, max_id, chunk):
+            await self._write(game_name, lambda conn, low=low: conn.execute(
+                chunk_sql, (cleared, low, low + chunk, reset_at, cleared)
+            ))
 
 logic_service = LogicService()
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict
+from .config import config
+from .connections import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+class MaintenanceScheduler:
+    """Periodic storage upkeep for open game databases.
+
+    Every MAINTENANCE_INTERVAL seconds each open database is visited on its
+    writer thread, so the work is serialized with that game's writes and
+    never runs on the request path:
+
+    - WAL larger than WAL_CHECKPOINT_BYTES: PASSIVE checkpoint; larger than
+      WAL_TRUNCATE_BYTES: TRUNCATE checkpoint, which also shrinks the file
+    - every OPTIMIZE_INTERVAL seconds: PRAGMA optimize (ANALYZE where stale)
+    - with INCREMENTAL_VACUUM: release up to VACUUM_PAGES free pages
+
+    Databases closed by LRU eviction are checkpointed on close instead.
+    """
+
+    def __init__(self, connections: ConnectionManager):
+        self._connections = connections
+        self._task = None
+        self._last_optimize: Dict[str, float] = {}
+        self.runs = 0
+        self.checkpoints = 0
+        self.truncates = 0
+        self.busy_checkpoints = 0
+        self.optimizes = 0
+        self.vacuumed_pages = 0
+        self.errors = 0
+        self.last_run_seconds = 0.0
+        self.wal_bytes: Dict[str, int] = {}
+
+    def start(self):
+        """Start the schedule. Must be called from the running event loop."""
+        if self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.MAINTENANCE_INTERVAL)
+            await self.run_once()
+
+    async def run_once(self):
+        start = time.perf_counter()
+        now = time.time()
+        for db_path in self._connections.open_paths():
+            optimize = now - self._last_optimize.setdefault(db_path, now) >= config.OPTIMIZE_INTERVAL
+            try:
+                result = await self._connections.run_write_open(
+                    db_path, lambda conn: self._maintain(conn, db_path, optimize), transaction=False
+                )
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Maintenance failed for {db_path}: {e}")
+                continue
+            if result is None:
+                # Evicted since open_paths(); it was checkpointed on close
+                continue
+            if optimize:
+                self._last_optimize[db_path] = now
+            self._record(db_path, result)
+        # Forget databases that are no longer open
+        open_paths = set(self._connections.open_paths())
+        for db_path in list(self.wal_bytes):
+            if db_path not in open_paths:
+                del self.wal_bytes[db_path]
+                self._last_optimize.pop(db_path, None)
+        self.runs += 1
+        self.last_run_seconds = time.perf_counter() - start
+
+    def _maintain(self, conn: sqlite3.Connection, db_path: str, optimize: bool) -> dict:
+        """One database's upkeep. Runs on its writer thread, outside any transaction."""
+        result = {"wal_bytes": self._wal_size(db_path), "checkpoint": None, "busy": False,
+                  "optimized": False, "vacuumed": 0}
+        if result["wal_bytes"] >= config.WAL_CHECKPOINT_BYTES:
+            mode = "TRUNCATE" if result["wal_bytes"] >= config.WAL_TRUNCATE_BYTES else "PASSIVE"
+            busy, _, _ = conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+            result["checkpoint"] = mode
+            # Readers in other processes can keep a checkpoint from finishing; it is retried next run
+            result["busy"] = bool(busy)
+            result["wal_bytes"] = self._wal_size(db_path)
+
+        if optimize:
+            # 0x10002: consider every table, not just those this connection queried
+            conn.execute("PRAGMA analysis_limit=1000;")
+            conn.execute("PRAGMA optimize=0x10002;")
+            result["optimized"] = True
+
+        if config.INCREMENTAL_VACUUM and conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2:
+            free_pages = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+            if free_pages > config.VACUUM_PAGES:
+                # execute() steps the pragma once (one page); executescript runs it to completion
+                conn.executescript(f"PRAGMA incremental_vacuum({int(config.VACUUM_PAGES)});")
+                result["vacuumed"] = free_pages - conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        return result
+
+    def _wal_size(self, db_path: str) -> int:
+        try:
+            return os.path.getsize(db_path + "-wal")
+        except OSError:
+            return 0
+
+    def _record(self, db_path: str, result: dict):
+        self.wal_bytes[db_path] = result["wal_bytes"]
+        if result["checkpoint"] == "TRUNCATE":
+            self.truncates += 1
+        elif result["checkpoint"] == "PASSIVE":
+            self.checkpoints += 1
+        if result["busy"]:
+            self.busy_checkpoints += 1
+        if result["optimized"]:
+            self.optimizes += 1
+        self.vacuumed_pages += result["vacuumed"]
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "checkpoints": self.checkpoints,
+            "truncates": self.truncates,
+            "busy_checkpoints": self.busy_checkpoints,
+            "optimizes": self.optimizes,
+            "vacuumed_pages": self.vacuumed_pages,
+            "errors": self.errors,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+            "wal_bytes": dict(self.wal_bytes),
+        }
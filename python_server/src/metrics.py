@@ -0,0 +1,347 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans sub-millisecond SQLite calls up to requests stuck behind a full queue
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class _Series:
+    """Base for metrics aggregated per thread.
+
+    Each thread updates only its own dict of series, so recording takes no
+    lock; a scrape copies every thread's dict and merges them. Dicts of
+    finished threads (e.g. readers of an evicted database) are folded into
+    one retired dict so the list does not grow with thread churn.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self._retired: dict = {}
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _series(self) -> dict:
+        series = getattr(self._local, "series", None)
+        if series is None:
+            series = self._local.series = {}
+            with self._shards_lock:
+                self._shards.append((threading.current_thread(), series))
+        return series
+
+    def _merge(self, into: dict, shard: dict):
+        raise NotImplementedError
+
+    def _totals(self) -> dict:
+        with self._shards_lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            totals: dict = {}
+            self._merge(totals, self._retired)
+        for _, shard in live:
+            self._merge(totals, shard.copy())
+        return totals
+
+    def snapshot(self) -> dict:
+        return self._totals()
+
+class Counter(_Series):
+    def inc(self, *label_values, amount: float = 1.0):
+        if not config.METRICS_ENABLED:
+            return
+        series = self._series()
+        series[label_values] = series.get(label_values, 0.0) + amount
+
+    def _merge(self, into: dict, shard: dict):
+        for key, value in shard.items():
+            into[key] = into.get(key, 0.0) + value
+
+    def render(self, totals: dict) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(totals.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+class Histogram(_Series):
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values):
+        if not config.METRICS_ENABLED:
+            return
+        series = self._series()
+        entry = series.get(label_values)
+        if entry is None:
+            # Per-bucket counts (the last one is +Inf), then the sum
+            entry = series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def _merge(self, into: dict, shard: dict):
+        for key, entry in shard.items():
+            total = into.get(key)
+            if total is None:
+                into[key] = list(entry)
+            else:
+                for i, value in enumerate(entry):
+                    total[i] += value
+
+    def render(self, totals: dict) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, entry in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), key + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(entry[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+class Gauge:
+    """Value read at scrape time: collect() returns {label_values: value}.
+
+    metric_type="counter" exposes cumulative counts that other components already keep.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Dict[tuple, float]], metric_type: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect
+        self.metric_type = metric_type
+        REGISTRY.append(self)
+
+    def snapshot(self) -> dict:
+        return self.collect()
+
+    def _merge(self, into: dict, values: dict):
+        # Per-process values add up to the instance total (open handles, queued requests, ...)
+        for key, value in values.items():
+            into[key] = into.get(key, 0.0) + value
+
+    def render(self, totals: dict) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        for key, value in sorted(totals.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+REGISTRY: list = []
+
+# With WORKERS > 1 every worker writes its numbers here, so whichever worker answers
+# a scrape can report the whole instance (see WorkerSync)
+METRICS_DIR = "_metrics"
+
+def _snapshot() -> Dict[str, dict]:
+    # Label values as strings, as they are rendered and as they come back from JSON
+    return {
+        metric.name: {tuple(str(value) for value in key): entry for key, entry in metric.snapshot().items()}
+        for metric in REGISTRY
+    }
+
+def render_all() -> str:
+    totals = {name: {} for name in (metric.name for metric in REGISTRY)}
+    snapshots = [(_snapshot(), True)]
+    if config.WORKERS > 1:
+        snapshots += worker_sync.others()
+    for snapshot, live in snapshots:
+        for metric in REGISTRY:
+            if not live and isinstance(metric, Gauge) and metric.metric_type == "gauge":
+                # Current values of a worker that stopped updating its file no longer exist
+                continue
+            metric._merge(totals[metric.name], snapshot.get(metric.name, {}))
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(totals[metric.name]))
+    return "\n".join(lines) + "\n"
+
+class WorkerSync:
+    """Shares metrics between uvicorn worker processes through files.
+
+    Each worker writes its merged series to DATA_DIR/_metrics/{pid}.json every
+    METRICS_SYNC_INTERVAL seconds and on shutdown. A scrape adds the files of the
+    other workers to its own live numbers, so the instance reports one set of
+    series whichever worker answers; other workers' numbers are up to one
+    interval old. Counters of workers that exited stay in the sum (run.py clears
+    the directory on start), their gauges are dropped once the file goes stale.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _directory(self) -> str:
+        return os.path.join(config.DATA_DIR, METRICS_DIR)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        # Final numbers of an orderly exit
+        self.write()
+
+    def _run(self):
+        while not self._stop.wait(config.METRICS_SYNC_INTERVAL):
+            self.write()
+
+    def write(self):
+        path = os.path.join(self._directory(), f"{os.getpid()}.json")
+        snapshot = {name: [[list(key), entry] for key, entry in series.items()] for name, series in _snapshot().items()}
+        try:
+            os.makedirs(self._directory(), exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Writing worker metrics to {path} failed: {e}")
+
+    def others(self) -> List[Tuple[Dict[str, dict], bool]]:
+        """(snapshot, live) of every other worker's file; live if it was written recently."""
+        own = f"{os.getpid()}.json"
+        stale_after = max(3 * config.METRICS_SYNC_INTERVAL, 5.0)
+        result = []
+        try:
+            names = os.listdir(self._directory())
+        except OSError:
+            return result
+        for name in names:
+            if not name.endswith(".json") or name == own:
+                continue
+            path = os.path.join(self._directory(), name)
+            try:
+                live = time.time() - os.path.getmtime(path) < stale_after
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                # Replaced or removed while reading; picked up by the next scrape
+                continue
+            result.append(({metric: {tuple(key): entry for key, entry in series} for metric, series in data.items()}, live))
+        return result
+
+    def clear(self):
+        """Remove the files of a previous run. Call before the workers start."""
+        try:
+            names = os.listdir(self._directory())
+        except OSError:
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(self._directory(), name))
+            except OSError:
+                pass
+
+worker_sync = WorkerSync()
+
+# Request context: the admission gate fills in the game so the middleware can label by it
+_request_game: ContextVar[Optional[list]] = ContextVar("request_game", default=None)
+
+def set_request_game(game_name: str):
+    holder = _request_game.get()
+    if holder is not None:
+        holder[0] = game_name
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency per route and game", ("route", "game", "status"))
+STAGE_SECONDS = Histogram(
+    "request_stage_seconds",
+    "Time per request stage: admission wait and logic (SQLite plus row conversion); the rest of "
+    "http_request_duration_seconds is parsing and serialization",
+    ("stage", "game"),
+)
+LOCK_WAIT_SECONDS = Histogram("game_lock_wait_seconds", "Wait for the per-game LockList lock", ("game",))
+SQLITE_SECONDS = Histogram(
+    "sqlite_seconds", "SQLite time per database file: writer queue wait, execute, commit, and reads", ("db", "stage")
+)
+ROWS_RETURNED = Counter("query_rows_returned_total", "Rows returned by /query", ("game", "kind"))
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route, game and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        holder = [""]
+        token = _request_game.set(holder)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_game.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners cannot blow up the series count
+            path = getattr(route, "path", None) or "other"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path, holder[0], str(status[0]))
+
+def register_service_gauges(logic_service, admission):
+    """Scrape-time views of the connection manager, queues, admission gates and caches."""
+    connections = logic_service.connections
+    Gauge("db_handles", "Open database handles and those in use", ("state",),
+          lambda: {("open",): connections.stats()["open"], ("busy",): connections.stats()["busy"]})
+    Gauge("db_handle_events_total", "Database handles opened and evicted", ("event",),
+          lambda: {("opened",): connections.opened, ("evicted",): connections.evictions}, "counter")
+    Gauge("db_write_queue_depth", "Writes waiting for each database's writer thread", ("db",),
+          lambda: {(os.path.basename(path),): depth for path, depth in connections.queue_depths().items()})
+    Gauge("admission_requests", "Requests per game running or waiting at the admission gate", ("game", "state"),
+          lambda: {(game, state): stats[state] for game, stats in admission.stats().items() for state in ("active", "queued")})
+    Gauge("admission_decisions_total", "Requests admitted or rejected with 429 per game", ("game", "decision"),
+          lambda: {(game, decision): stats[decision]
+                   for game, stats in admission.stats().items() for decision in ("admitted", "rejected")}, "counter")
+    Gauge("write_behind_pending_rows", "Buffered /insert heartbeats per game", ("game",),
+          lambda: {(game,): count for game, count in logic_service.write_buffer.sizes().items()})
+    Gauge("hot_set_entries", "Accounts held in the in-memory hot set per game", ("game",),
+          lambda: {(game,): count for game, count in logic_service.hot_set.stats().items()})
+    Gauge("statement_cache_events_total", "Statement cache hits, misses and evictions", ("event",),
+          lambda: {(event,): logic_service.statements.stats()[event] for event in ("hits", "misses", "evictions")},
+          "counter")
+    Gauge("maintenance_events_total", "Storage maintenance checkpoints, optimizes and vacuumed pages", ("event",),
+          lambda: {(event,): logic_service.maintenance.stats()[event]
+                   for event in ("checkpoints", "truncates", "busy_checkpoints", "optimizes", "vacuumed_pages", "errors")},
+          "counter")
@@ -18,6 +18,10 @@ class BaseInfo(BaseModel):
             raise ValueError("游戏名必须是字母数字或下划线且以字母开头")
         return v
 
+class NewGameReq(BaseInfo):
+    # Durability profile (Config.DURABILITY_PROFILES); None keeps DEFAULT_PROFILE
+    Profile: Optional[str] = Field(None, alias="profile")
+
 class QueryReq(BaseInfo):
     OnlineDuration: int = Field(0, alias="online_duration")
     TalkChannel: int = Field(0, alias="talk_channel")
@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+# Predicate bits of a /query, combined into the cache key
+PRED_ACCOUNT = 1
+PRED_B_ZONE = 2
+PRED_S_ZONE = 4
+PRED_RATING = 8
+PRED_ONLINE = 16
+PRED_TALK = 32
+
+class StatementCache:
+    """LRU cache of finished SQL text.
+
+    Keys look like (game_name, kind, predicate_mask, talk_channel). Handing
+    sqlite3 the very same string for the same query shape lets each
+    connection's prepared statement cache (Config.CACHED_STATEMENTS) reuse
+    the compiled statement instead of re-preparing it.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = max(1, capacity)
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, build: Callable[[], str]) -> str:
+        with self._lock:
+            sql = self._entries.get(key)
+            if sql is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return sql
+            self.misses += 1
+        sql = build()
+        with self._lock:
+            self._entries[key] = sql
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return sql
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self._capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import logging
+from typing import Awaitable, Callable, Dict, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# (game_name, account, b_zone, s_zone, rating, online_time)
+# online_time is text or epoch seconds, matching the game table's schema
+PendingRow = Tuple[str, str, str, str, int, Union[str, int]]
+
+class WriteBehindBuffer:
+    """In-memory buffer of pending /insert upserts, keyed by game then account.
+
+    Works like the Go cache.Insert: repeated heartbeats for the same account
+    overwrite each other, and a game is flushed once it holds `batch_size`
+    accounts or every `flush_interval` seconds, whichever comes first.
+    The buffer itself never touches SQLite; the coroutine `flush_fn(game_name)`
+    is awaited to drain a game, so the owner controls locking and ordering.
+    The periodic flush is a task on the event loop; the lock is still needed
+    because rows are taken on the database writer threads.
+    """
+
+    def __init__(self, flush_fn: Callable[[str], Awaitable[None]], batch_size: int, flush_interval: float):
+        self._flush_fn = flush_fn
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._pending: Dict[str, Dict[str, PendingRow]] = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def add(self, row: PendingRow) -> bool:
+        """Buffer a row. Returns True when the game reached the batch size and should be flushed."""
+        game_name, account = row[0], row[1]
+        with self._lock:
+            rows = self._pending.get(game_name)
+            if rows is None:
+                rows = self._pending[game_name] = {}
+            rows[account] = row
+            return len(rows) >= self._batch_size
+
+    def take(self, game_name: str) -> List[PendingRow]:
+        with self._lock:
+            rows = self._pending.pop(game_name, None)
+        return list(rows.values()) if rows else []
+
+    def restore(self, game_name: str, rows: List[PendingRow]):
+        """Put rows back after a failed flush without clobbering newer heartbeats."""
+        with self._lock:
+            pending = self._pending.setdefault(game_name, {})
+            for row in rows:
+                pending.setdefault(row[1], row)
+
+    def sizes(self) -> Dict[str, int]:
+        with self._lock:
+            return {game_name: len(rows) for game_name, rows in self._pending.items()}
+
+    def games(self) -> List[str]:
+        with self._lock:
+            return list(self._pending.keys())
+
+    async def flush_all(self):
+        for game_name in self.games():
+            try:
+                await self._flush_fn(game_name)
+            except Exception as e:
+                logger.error(f"Write-behind flush failed for {game_name}: {e}")
+
+    def start(self):
+        """Start the periodic flush. Must be called from the running event loop."""
+        if self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Drain whatever is left so an orderly shutdown loses nothing
+        await self.flush_all()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush_all()